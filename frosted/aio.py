@@ -0,0 +1,71 @@
+"""frosted/aio.py.
+
+Defines an asyncio friendly api for frosted, running checks in an executor so they never block the event loop.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and
+to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+
+"""
+import asyncio
+import functools
+import os
+import time
+
+from frosted import engine
+from frosted.api import _check_source, _read_source, check
+from frosted.reporter import Recorder
+
+__all__ = ['acheck', 'acheck_paths']
+
+
+def _check_buffer(codeString, filename, settings_path, setting_overrides):
+    recorder = Recorder()
+    started = time.time()
+    warnings = check(codeString, filename, recorder, settings_path, **setting_overrides)
+    return engine.Result(filename, warnings, recorder.messages, recorder.errors, time.time() - started)
+
+
+async def acheck(codeString, filename, executor=None, settings_path=None, **setting_overrides):
+    """Check the Python source given by codeString in an executor, returning an engine.Result."""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(executor, _check_buffer, codeString, filename, settings_path,
+                                      setting_overrides)
+
+
+async def acheck_paths(paths, concurrency=None, executor=None, settings_path=None, **setting_overrides):
+    """Check every path in an executor, yielding an engine.Result for each file as soon as it has been checked.
+
+    At most concurrency files (by default one per CPU) are read and checked at once, and paths is consumed lazily,
+    so it can be as long as needed. Results arrive in completion order rather than the order paths were given.
+
+    """
+    loop = asyncio.get_event_loop()
+    concurrency = concurrency or os.cpu_count() or 1
+    paths = iter(paths)
+    pending = set()
+    check_file = functools.partial(engine.check_file, _read_source, _check_source)
+    try:
+        while True:
+            for path in paths:
+                pending.add(loop.run_in_executor(executor, check_file, path, settings_path, setting_overrides))
+                if len(pending) >= concurrency:
+                    break
+            if not pending:
+                return
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
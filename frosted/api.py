@@ -16,8 +16,10 @@ THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABI
 CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 
 """
+import hashlib
 import os
 import re
+import stat
 import sys
 import tokenize
 from io import StringIO
@@ -25,12 +27,18 @@ from token import N_TOKENS
 
 from pies.overrides import *
 
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
+
 import _ast
 from frosted import reporter as modReporter
-from frosted import checker, settings
+from frosted import cache, checker, engine, git, settings
 from frosted.messages import FileSkipped, PythonSyntaxError
 
-__all__ = ['check', 'check_path', 'check_recursive', 'iter_source_code']
+__all__ = ['check', 'check_path', 'check_paths', 'check_recursive', 'check_staged', 'check_stream',
+           'iter_source_code', 'read_buffers']
 
 _re_noqa = re.compile(r'((frosted)[:=]\s*noqa)|(#\s*noqa)', re.I)
 
@@ -59,14 +67,51 @@ def _should_skip(filename, skip):
         position = os.path.split(position[0])
 
 
-def check(codeString, filename, reporter=modReporter.Default, settings_path=None, **setting_overrides):
-    """Check the Python source given by codeString for unfrosted flakes."""
+def check(codeString, filename, reporter=modReporter.Default, settings_path=None, cache=None, parse_cache=None,
+          incremental=None, **setting_overrides):
+    """Check the Python source given by codeString for unfrosted flakes.
+
+    Given a cache.ResultCache, results are looked up there first and stored there afterwards. Given a
+    cache.ParseCache, the tree, noqa lines and results of sources checked recently are reused from memory. Given a
+    checker.Incremental, only the function bodies changed since filename was last checked with it are checked again.
+
+    """
+    active_settings = _effective_settings(filename, settings_path, setting_overrides)
+    parsed = None
+    if parse_cache is not None:
+        parsed = parse_cache.lookup(codeString, filename)
+        results_key = parse_cache.results_key(filename, active_settings)
+        if results_key in parsed.results:
+            recorder, warnings = parsed.results[results_key]
+            recorder.replay(reporter)
+            return warnings
+    if cache is None and parsed is None:
+        return _check(codeString, filename, reporter, active_settings, incremental=incremental)
+
+    cached = None
+    if cache is not None:
+        key = cache.key(codeString, filename, active_settings)
+        cached = cache.get(key)
+    if cached:
+        recorder, warnings = cached
+    else:
+        recorder = modReporter.Recorder()
+        warnings = _check(codeString, filename, recorder, active_settings, parsed, incremental)
+        if cache is not None:
+            cache.put(key, recorder, warnings)
+    if parsed is not None:
+        parsed.results[results_key] = (recorder, warnings)
+    recorder.replay(reporter)
+    return warnings
 
+
+def _effective_settings(filename, settings_path, setting_overrides):
+    """Returns the settings that apply to filename once setting_overrides have been merged in."""
     if not settings_path and filename:
         settings_path = os.path.dirname(os.path.abspath(filename))
     settings_path = settings_path or os.getcwd()
 
-    active_settings = settings.from_path(settings_path).copy()
+    active_settings = settings.from_path(settings_path)
     for key, value in itemsview(setting_overrides):
         access_key = key.replace('not_', '').lower()
         if type(active_settings.get(access_key)) in (list, tuple):
@@ -77,7 +122,10 @@ def check(codeString, filename, reporter=modReporter.Default, settings_path=None
         else:
             active_settings[key] = value
     active_settings.update(setting_overrides)
+    return active_settings
+
 
+def _check(codeString, filename, reporter, active_settings, parsed=None, incremental=None):
     if _should_skip(filename, active_settings.get('skip', [])):
         if active_settings.get('directly_being_checked', None) == 1:
             reporter.flake(FileSkipped(filename))
@@ -90,7 +138,7 @@ def check(codeString, filename, reporter=modReporter.Default, settings_path=None
 
     # First, compile into an AST and handle syntax errors.
     try:
-        tree = compile(codeString, filename, "exec", _ast.PyCF_ONLY_AST)
+        tree = parsed and parsed.tree or compile(codeString, filename, "exec", _ast.PyCF_ONLY_AST)
     except SyntaxError:
         value = sys.exc_info()[1]
         msg = value.args[0]
@@ -111,43 +159,341 @@ def check(codeString, filename, reporter=modReporter.Default, settings_path=None
         reporter.unexpected_error(filename, 'problem decoding source')
         return 1
     # Okay, it's syntactically valid.  Now check it.
-    w = checker.Checker(tree, filename, None, ignore_lines=_noqa_lines(codeString), **active_settings)
+    if parsed is None:
+        ignore_lines = _noqa_lines(codeString)
+    else:
+        parsed.tree = tree
+        if parsed.noqa_lines is None:
+            parsed.noqa_lines = frozenset(_noqa_lines(codeString))
+        ignore_lines = parsed.noqa_lines
+    w = checker.Checker(tree, filename, None, ignore_lines=ignore_lines, incremental=incremental, **active_settings)
     w.messages.sort(key=lambda m: m.lineno)
     for warning in w.messages:
         reporter.flake(warning)
     return len(w.messages)
 
 
-def check_path(filename, reporter=modReporter.Default, settings_path=None, **setting_overrides):
-    """Check the given path, printing out any warnings detected."""
+def _read_source(filename):
+    """Returns (source, None) for the given path, or (None, error message) if it can not be read."""
     try:
         with open(filename, 'U') as f:
-            codestr = f.read() + '\n'
+            return (f.read() + '\n', None)
     except UnicodeError:
-        reporter.unexpected_error(filename, 'problem decoding source')
-        return 1
+        return (None, 'problem decoding source')
     except IOError:
         msg = sys.exc_info()[1]
-        reporter.unexpected_error(filename, msg.args[1])
+        return (None, msg.args[1])
+
+
+def _check_source(filename, source, reporter=modReporter.Default, settings_path=None, **setting_overrides):
+    """Check a (source, error message) pair produced by _read_source."""
+    codestr, error = source
+    if error:
+        reporter.unexpected_error(filename, error)
         return 1
     return check(codestr, filename, reporter, settings_path, **setting_overrides)
 
 
-def iter_source_code(paths):
-    """Iterate over all Python source files defined in paths."""
+class _Known(object):
+    """Looks up and records the results of checking files in a cache.StatIndex on behalf of engine.run."""
+
+    def __init__(self, index, settings_path, setting_overrides):
+        self.index = index
+        self.settings_path = settings_path
+        self.setting_overrides = dict((key, value) for key, value in itemsview(setting_overrides) if key != 'cache')
+        self.pending = {}
+
+    def lookup(self, filename):
+        active_settings = _effective_settings(filename, self.settings_path, self.setting_overrides)
+        status, signature = self.index.stat(filename), cache.signature(filename, active_settings)
+        remembered = self.index.lookup(filename, status, signature)
+        if remembered:
+            recorder, warnings = remembered
+            return engine.Result(filename, warnings, recorder.messages, recorder.errors, 0)
+        self.pending[filename] = (status, signature)
+
+    def record(self, result):
+        status, signature = self.pending.pop(result.filename, (None, None))
+        self.index.record(result.filename, status, signature, modReporter.Recorder(result.messages, result.errors),
+                          result.warnings)
+
+
+class _Duplicates(object):
+    """Finds the files that would give the same results as an earlier one on behalf of engine.run: those with the
+    same name, settings and bytes. Only files the same size as another are read."""
+
+    def __init__(self, settings_path, setting_overrides):
+        self.settings_path = settings_path
+        self.setting_overrides = dict((key, value) for key, value in itemsview(setting_overrides) if key != 'cache')
+        self.found = 0
+
+    def key(self, filename):
+        with open(filename, 'rb') as source:
+            digest = hashlib.sha256(source.read()).hexdigest()
+        active_settings = _effective_settings(filename, self.settings_path, self.setting_overrides)
+        return (digest, cache.signature(os.path.basename(filename), active_settings),
+                bool(_should_skip(filename, active_settings.get('skip', []))))
+
+    def __call__(self, paths):
+        candidates = {}
+        for index, path in enumerate(paths):
+            try:
+                candidates.setdefault((os.path.getsize(path), os.path.basename(path)), []).append(index)
+            except OSError:
+                continue
+
+        duplicates = {}
+        for indexes in candidates.values():
+            originals = {}
+            for index in indexes if len(indexes) > 1 else ():
+                try:
+                    original = originals.setdefault(self.key(paths[index]), index)
+                except (IOError, OSError):
+                    continue
+                if original != index:
+                    duplicates[index] = original
+        self.found += len(duplicates)
+        return duplicates
+
+
+def check_path(filename, reporter=modReporter.Default, settings_path=None, index=None, **setting_overrides):
+    """Check the given path, printing out any warnings detected.
+
+    Given a cache.StatIndex, the file is not even read if it has not changed since it was last checked.
+
+    """
+    if index is not None:
+        return engine.run(_read_source, _check_source, [filename], reporter, settings_path,
+                          known=_Known(index, settings_path, setting_overrides), **setting_overrides)
+    return _check_source(filename, _read_source(filename), reporter, settings_path, **setting_overrides)
+
+
+def check_paths(filenames, reporter=modReporter.Default, settings_path=None, max_errors=None, time_limit=None,
+                memory_limit=None, recycle_after=None, recycle_memory=None, index=None, **setting_overrides):
+    """Check each of the given paths in turn, as check_path does, returning the warning total.
+
+    Checking stops once max_errors warnings have been found. time_limit, memory_limit, recycle_after and
+    recycle_memory put each file on a budget in a worker process, just as for check_recursive.
+
+    """
+    known = _Known(index, settings_path, setting_overrides) if index is not None else None
+    return engine.run(_read_source, _check_source, filenames, reporter, settings_path, max_errors=max_errors,
+                      time_limit=time_limit, memory_limit=memory_limit, recycle_after=recycle_after,
+                      recycle_memory=recycle_memory, known=known, **setting_overrides)
+
+
+def _entries(directory, device):
+    """Returns the (path, is_directory, identity) of each entry of directory, identity being its (device, inode).
+
+    Symbolic links are returned with is_directory and identity both None. Where scandir is available only directories
+    need a stat call, as files share the device of the directory containing them.
+
+    """
+    entries = []
+    try:
+        if scandir is not None:
+            for entry in scandir(directory):
+                if entry.is_symlink():
+                    entries.append((entry.path, None, None))
+                elif entry.is_dir(follow_symlinks=False):
+                    status = entry.stat(follow_symlinks=False)
+                    entries.append((entry.path, True, (status.st_dev, status.st_ino)))
+                else:
+                    entries.append((entry.path, False, (device, entry.inode())))
+            return entries
+
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            status = os.lstat(path)
+            if stat.S_ISLNK(status.st_mode):
+                entries.append((path, None, None))
+            else:
+                entries.append((path, stat.S_ISDIR(status.st_mode), (status.st_dev, status.st_ino)))
+    except OSError:
+        pass
+    return entries
+
+
+def _first_sighting(identity, seen):
+    """Returns True unless the file or directory known by identity is in seen, adding it if not."""
+    if not identity[1]:
+        return True  # no inode numbers on this platform, so nothing can be recognised
+    if identity in seen:
+        return False
+    seen.add(identity)
+    return True
+
+
+def iter_source_code(paths, follow_symlinks=False):
+    """Iterate over all Python source files defined in paths, each physical file only once.
+
+    Files and directories are recognised by their device and inode, so that overlapping paths, hard links and
+    symbolic links never yield the same file twice. Symbolic links to directories are only walked if follow_symlinks
+    is set, in which case each target is walked once however many links, or cycles, lead to it.
+
+    """
+    seen = set()
     for path in paths:
-        if os.path.isdir(path):
-            for dirpath, dirnames, filenames in os.walk(path):
-                for filename in filenames:
-                    if filename.endswith('.py'):
-                        yield os.path.join(dirpath, filename)
-        else:
+        try:
+            status = os.stat(path)
+        except OSError:
+            yield path
+            continue
+        if not _first_sighting((status.st_dev, status.st_ino), seen):
+            continue
+        if not stat.S_ISDIR(status.st_mode):
             yield path
+            continue
 
+        directories = [(path, status.st_dev)]
+        while directories:
+            directory, device = directories.pop()
+            subdirectories = []
+            for (entry, is_directory, identity) in _entries(directory, device):
+                if identity is None:
+                    if not follow_symlinks and not entry.endswith('.py'):
+                        continue
+                    try:
+                        status = os.stat(entry)
+                    except OSError:
+                        continue
+                    is_directory, identity = stat.S_ISDIR(status.st_mode), (status.st_dev, status.st_ino)
+                    if is_directory and not follow_symlinks:
+                        continue
+                if is_directory:
+                    if _first_sighting(identity, seen):
+                        subdirectories.append((entry, identity[0]))
+                elif entry.endswith('.py') and _first_sighting(identity, seen):
+                    yield entry
+            directories.extend(reversed(subdirectories))
 
-def check_recursive(paths, reporter=modReporter.Default, settings_path=None, **setting_overrides):
-    """Recursively check all source files defined in paths."""
+
+def check_recursive(paths, reporter=modReporter.Default, settings_path=None, jobs=1, read_ahead=0, shard=None,
+                    history=None, threads=False, fail_fast=False, max_errors=None, time_limit=None, memory_limit=None,
+                    recycle_after=None, recycle_memory=None, index=None, dedupe=True, stats=None,
+                    follow_symlinks=False, **setting_overrides):
+    """Recursively check all source files defined in paths.
+
+    Up to jobs processes (0 for one per CPU) are used, or threads of this process if threads is set. When checking
+    in a single process, read_ahead files are read by background threads while earlier ones are being checked.
+    Passing shard as an (index, count) pair only checks the files that belong to that shard, see engine.shard.
+    history is the path of a file used to remember how long each file took to check, so that parallel runs can start
+    the slowest files first. Checking stops early, abandoning outstanding files, once max_errors warnings have been
+    found, or after the first file with a warning if fail_fast is set.
+
+    Files that take more than time_limit seconds, or more than memory_limit megabytes, to check are abandoned and
+    reported as over budget. The worker processes doing the checking are replaced after recycle_after files, or once
+    they have used recycle_memory megabytes.
+
+    Given a cache.StatIndex, files that have not changed since they were last checked are not even read, and files
+    that have gone from within paths are forgotten.
+
+    Unless dedupe is turned off, files with the same name, bytes and settings as another are only checked once, the
+    results being repeated for each. Given a stats dictionary, the number of files spared is stored under
+    'duplicates'.
+
+    Each physical file is checked once however many of paths lead to it. Symbolic links to directories are only
+    followed if follow_symlinks is set.
+
+    """
+    source_paths = iter_source_code(paths, follow_symlinks)
+    known = None
+    if index is not None:
+        source_paths = list(source_paths)
+        index.prune(paths, source_paths)
+        known = _Known(index, None, setting_overrides)
+    if shard:
+        source_paths = engine.shard(source_paths, *shard)
+    duplicates = _Duplicates(None, setting_overrides) if dedupe else None
+    warnings = engine.run(_read_source, _check_source, source_paths, reporter, None, jobs=jobs, read_ahead=read_ahead,
+                          history=history, threads=threads, max_errors=1 if fail_fast else max_errors,
+                          time_limit=time_limit, memory_limit=memory_limit, recycle_after=recycle_after,
+                          recycle_memory=recycle_memory, known=known, find_duplicates=duplicates, **setting_overrides)
+    if index is not None:
+        index.flush()
+    if stats is not None:
+        stats['duplicates'] = duplicates.found if duplicates else 0
+    return warnings
+
+
+def read_buffers(stream):
+    """Yields a (filename, (source, error message)) pair for every buffer framed within stream.
+
+    Each buffer is sent as a header line, giving the length of its source and its filename separated by a space,
+    followed by exactly that much source. Lengths are in bytes for binary streams and characters for text streams.
+    There is no telling where the next buffer starts after a malformed header, so one is yielded as an error for
+    the pseudo file <stream>, after which nothing more is read.
+
+    """
+    while True:
+        header = stream.readline()
+        if not header:
+            return
+        if isinstance(header, bytes):
+            header = header.decode('utf-8')
+        if not header.strip():
+            continue
+        try:
+            length, filename = header.rstrip('\r\n').split(' ', 1)
+            length = int(length)
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            yield '<stream>', (None, 'malformed header: {0}'.format(header.strip()))
+            return
+        data = stream.read(length)
+        if len(data) < length:
+            return
+        if isinstance(data, bytes):
+            try:
+                data = data.decode('utf-8')
+            except UnicodeError:
+                yield filename, (None, 'problem decoding source')
+                continue
+        yield filename, (data + '\n', None)
+
+
+def check_stream(stream, output=sys.stdout, settings_path=None, **setting_overrides):
+    """Check every buffer framed within stream, see read_buffers, until it runs dry, returning the warning total.
+
+    Everything found in a buffer is written to output, followed by a line holding a single NUL character, as soon as
+    that buffer has been checked. Settings are found starting from each buffer's filename, just as for files on disk.
+
+    """
     warnings = 0
-    for source_path in iter_source_code(paths):
-        warnings += check_path(source_path, reporter, settings_path=None, **setting_overrides)
+    reporter = modReporter.Reporter(output, output)
+    for filename, source in read_buffers(stream):
+        warnings += _check_source(filename, source, reporter, settings_path, **setting_overrides)
+        output.write('\0\n')
+        output.flush()
     return warnings
+
+
+def check_staged(reporter=modReporter.Default, settings_path=None, repository=None, **setting_overrides):
+    """Check the Python files staged for commit in the git repository containing repository, or the working
+    directory, returning the warning total.
+
+    Files are checked as they are in the index, which may differ from the working tree, with their contents streamed
+    through a single git process. They are reported by, and take their settings from, their path in the working tree.
+
+    """
+    root = git.toplevel(repository or os.getcwd())
+    index_paths = dict((os.path.relpath(os.path.join(root, path)), path) for path in git.staged(root)
+                       if path.endswith('.py'))
+
+    with git.BlobReader(root) as blobs:
+        def read(filename):
+            content = blobs.read(':' + index_paths[filename])
+            if content is None:
+                return (None, 'not found in the index')
+            try:
+                return (content.decode('utf-8') + '\n', None)
+            except UnicodeError:
+                return (None, 'problem decoding source')
+
+        return engine.run(read, _check_source, sorted(index_paths), reporter, settings_path, **setting_overrides)
+
+
+if sys.version_info >= (3, 6):
+    from frosted.aio import acheck, acheck_paths
+    __all__ += ['acheck', 'acheck_paths']
@@ -0,0 +1,384 @@
+"""frosted/cache.py.
+
+Defines a persistent cache of check results, so that files which have not changed since they were last checked,
+with the same settings, interpreter, builtins, frosted version and plugins, are never compiled or walked again.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and
+to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import hashlib
+import json
+import os
+import platform
+import socket
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from io import StringIO
+
+from pies.overrides import *
+
+from frosted import __version__, checker, engine, plugins
+from frosted import reporter as modReporter
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+__all__ = ['DEFAULT_CACHE_DIR', 'DEFAULT_INDEX_PATH', 'ParseCache', 'Parsed', 'ResultCache', 'StatIndex', 'signature']
+
+DEFAULT_CACHE_DIR = os.path.join(engine.CACHE_DIR, 'results')
+# The StatIndex is kept per user and per host, never in a shared cache directory: the paths and metadata it remembers
+# only make sense on the host that recorded them, and SQLite databases are not safe to share over network file systems
+DEFAULT_INDEX_PATH = os.path.join(engine.CACHE_DIR, 'index-{0}.sqlite'.format(socket.gethostname() or 'localhost'))
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024  # The most bytes of results kept before the least recently used are evicted
+PRUNE_INTERVAL = 60 * 60  # How many seconds the command line tool waits between looking for entries to evict
+DEFAULT_PARSE_ENTRIES = 256  # The most sources a ParseCache keeps by default
+DEFAULT_PARSE_BYTES = 64 * 1024 * 1024  # Roughly the most memory a ParseCache uses by default
+TREE_BYTES_PER_CHARACTER = 32  # About how much memory the syntax tree of each character of source takes
+RACY_SECONDS = 2  # Files modified more recently than this might change again without their metadata changing
+INDEX_BATCH_ROWS = 64  # The most results a StatIndex holds in memory before writing them out together
+INDEX_BATCH_SECONDS = 1  # The longest a StatIndex holds results in memory before writing them out
+STALE_SECONDS = 60 * 60  # How old a temporary file has to be before it is assumed its writer has died
+TEMPORARY_SUFFIX = '.tmp'
+
+
+def _normalized(value):
+    if isinstance(value, (list, tuple, set)):
+        return sorted(str(item) for item in value)
+    return value
+
+
+def signature(filename, active_settings):
+    """Returns a hash of everything besides its source that affects the results of checking filename, including the
+    interpreter, whose grammar decides what is a syntax error, and the builtins, which are never undefined."""
+    effective_settings = dict((name, _normalized(value)) for name, value in itemsview(active_settings))
+    interpreter = '{0} {1}'.format(platform.python_implementation(), '.'.join(str(part) for part in sys.version_info))
+    digest = hashlib.sha256()
+    for part in (__version__, interpreter, json.dumps(sorted(checker.FROSTED_BUILTINS)),
+                 json.dumps(plugins.registry.describe()), filename,
+                 json.dumps(effective_settings, sort_keys=True, default=str)):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class ResultCache(namedtuple('ResultCache', ('directory', 'max_size', 'read_only'))):
+    """Stores the results of checking each source, as one small file per key within directory.
+
+    Results are found by a hash of everything that can affect them, so entries never have to be invalidated, only
+    evicted. Reading an entry marks it as recently used, and prune removes the least recently used entries once the
+    cache has grown beyond max_size bytes.
+
+    Any number of processes, on any number of hosts, can share one directory without locking: entries are written
+    under a unique temporary name and renamed into place, each starts with a checksum of the rest so that truncated
+    or otherwise damaged entries are treated as missing, and entries for a key are always interchangeable. With
+    read_only set, nothing within directory is ever written to.
+
+    """
+
+    def __new__(cls, directory=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE, read_only=False):
+        return super(ResultCache, cls).__new__(cls, directory, max_size, read_only)
+
+    def key(self, codeString, filename, active_settings):
+        """Returns the key for the results of checking codeString as filename with active_settings."""
+        digest = hashlib.sha256(signature(filename, active_settings).encode('utf-8'))
+        digest.update(codeString.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def get(self, key):
+        """Returns the (Recorder, warnings) stored for key, or None if there is nothing usable."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as entry:
+                checksum, content = entry.read().split(b'\n', 1)
+            if hashlib.sha256(content).hexdigest().encode('ascii') != checksum:
+                return None
+            result = modReporter.load(StringIO(content.decode('utf-8')))
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+        if not self.read_only:
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+        return result
+
+    def put(self, key, recorder, warnings):
+        """Stores the results recorded for key, quietly giving up if the cache can not be written to."""
+        if self.read_only:
+            return
+        path = self._path(key)
+        temporary_path = '{0}.{1}{2}'.format(path, uuid.uuid4().hex, TEMPORARY_SUFFIX)
+        try:
+            content = modReporter.dumps(recorder, warnings).encode('utf-8')
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                if not os.path.isdir(os.path.dirname(path)):
+                    raise
+            with open(temporary_path, 'wb') as entry:
+                entry.write(hashlib.sha256(content).hexdigest().encode('ascii') + b'\n' + content)
+            getattr(os, 'replace', os.rename)(temporary_path, path)
+        except (IOError, OSError, TypeError, ValueError):
+            try:
+                os.remove(temporary_path)
+            except OSError:
+                pass
+
+    def prune(self, every=None):
+        """Evicts the least recently used entries until the cache is no larger than max_size.
+
+        Given every, nothing is done unless at least that many seconds have passed since the cache was last pruned,
+        sparing frequent runs from looking at every entry. Temporary files left behind by writers that were killed
+        are removed once they are STALE_SECONDS old. Any other files directly within the directory, such as the
+        per-host indexes earlier versions kept there, count towards max_size and are evicted in the same way, an
+        SQLite database together with its -wal and -shm files.
+
+        """
+        if self.read_only:
+            return
+        stamp = os.path.join(self.directory, 'pruned')
+        try:
+            if every and time.time() - os.path.getmtime(stamp) < every:
+                return
+        except OSError:
+            pass
+        if not os.path.isdir(self.directory):
+            return
+        try:
+            with open(stamp, 'w'):
+                pass
+        except (IOError, OSError):
+            pass
+
+        entries, total_size = {}, 0
+        for directory, directories, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                if path == stamp:
+                    continue
+                try:
+                    status = os.stat(path)
+                except OSError:
+                    continue
+                if filename.endswith(TEMPORARY_SUFFIX):
+                    if time.time() - status.st_mtime > STALE_SECONDS:
+                        _remove(path)
+                    continue
+                entry = entries.setdefault(path[:-4] if path.endswith(('-wal', '-shm')) else path, [0, 0, []])
+                entry[0] = max(entry[0], status.st_mtime)
+                entry[1] += status.st_size
+                entry[2].append(path)
+                total_size += status.st_size
+
+        for modified, size, paths in sorted(entries.values()):
+            if total_size <= self.max_size:
+                break
+            for path in paths:
+                _remove(path)
+            total_size -= size
+
+
+def _remove(path):
+    """Removes path, not minding if another process already has."""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class Parsed(object):
+    """What a ParseCache keeps for one source: its tree, or None until it has been parsed, its noqa lines, or None
+    until they have been found, and the (Recorder, warnings) it produced with each signature of settings."""
+    __slots__ = ('tree', 'noqa_lines', 'results')
+
+    def __init__(self):
+        self.tree = None
+        self.noqa_lines = None
+        self.results = {}
+
+
+class ParseCache(object):
+    """Keeps what was learnt checking the most recently used sources in memory, for processes that check the same
+    buffers over and over, such as editor integrations.
+
+    At most max_entries sources are kept, using no more than roughly max_bytes, with the least recently used ones
+    dropped first. hits and misses count how often a source was or was not found.
+
+    """
+
+    def __init__(self, max_entries=DEFAULT_PARSE_ENTRIES, max_bytes=DEFAULT_PARSE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, codeString, filename):
+        """Returns the Parsed entry for codeString checked as filename, starting an empty one if there is none."""
+        key = hashlib.sha256(filename.encode('utf-8') + b'\0' + codeString.encode('utf-8')).digest()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry:
+                self.hits += 1
+                self._entries[key] = entry
+                return entry[0]
+
+            self.misses += 1
+            parsed, size = Parsed(), len(codeString) * TREE_BYTES_PER_CHARACTER
+            self._entries[key] = (parsed, size)
+            self.size += size
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self.size > self.max_bytes):
+                evicted, evicted_size = self._entries.popitem(last=False)[1]
+                self.size -= evicted_size
+            return parsed
+
+    @staticmethod
+    def results_key(filename, active_settings):
+        """Returns what the results in a Parsed entry are kept under for the given settings."""
+        return signature(filename, active_settings)
+
+    def clear(self):
+        """Forgets every source kept, leaving the counters alone."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class StatIndex(object):
+    """Remembers the results for each file along with its metadata, within a single SQLite database at path.
+
+    As long as a file's device, inode, size and modification time, and the signature of its settings, are the same
+    as when it was last checked, its results can be reused without even opening it. Files modified within
+    RACY_SECONDS of being checked are not remembered, as they could change again without their metadata changing.
+    Without the sqlite3 module, or if the database can not be opened, nothing is ever remembered.
+
+    Results are held in memory and written out a batch at a time, each batch in a transaction of its own, so that
+    several processes can share the database. A batch that can not be written straight away because another process
+    is writing is dropped rather than waited for: those files are simply checked again next time.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+        self.pending = []
+        self.written = time.time()
+        if not sqlite3:
+            return
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            self.connection = sqlite3.connect(path, timeout=0)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, name TEXT, '
+                                    'device INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, '
+                                    'signature TEXT, results TEXT)')
+            self.connection.commit()
+        except (OSError, sqlite3.Error):
+            self.connection = None
+
+    @staticmethod
+    def stat(filename):
+        """Returns the (device, inode, size, modification time in nanoseconds) of filename, or None if missing."""
+        try:
+            status = os.stat(filename)
+        except OSError:
+            return None
+        return (status.st_dev, status.st_ino, status.st_size,
+                getattr(status, 'st_mtime_ns', None) or int(status.st_mtime * 1000000000))
+
+    def lookup(self, filename, status, signature):
+        """Returns the (Recorder, warnings) remembered for filename, if it still has the given status and signature."""
+        if not self.connection or not status:
+            return None
+        try:
+            row = self.connection.execute('SELECT name, device, inode, size, mtime_ns, signature, results FROM files '
+                                          'WHERE path = ?', (os.path.abspath(filename), )).fetchone()
+        except sqlite3.Error:
+            return None
+        if not row or tuple(row[:6]) != (filename, ) + tuple(status) + (signature, ):
+            return None
+        try:
+            return modReporter.load(StringIO(row[6]))
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    def record(self, filename, status, signature, recorder, warnings):
+        """Remembers the results of checking filename, as it was when it had the given status."""
+        if not self.connection or not status or time.time() - status[3] / 1000000000 < RACY_SECONDS:
+            return
+        self.pending.append((os.path.abspath(filename), filename) + tuple(status) +
+                            (signature, modReporter.dumps(recorder, warnings)))
+        if len(self.pending) >= INDEX_BATCH_ROWS or time.time() - self.written >= INDEX_BATCH_SECONDS:
+            self.flush()
+
+    def flush(self):
+        """Writes out the results remembered since the last flush, or forgets them if the database is busy."""
+        pending, self.pending, self.written = self.pending, [], time.time()
+        if not self.connection or not pending:
+            return
+        try:
+            self.connection.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)', pending)
+            self.connection.commit()
+        except sqlite3.Error:
+            self._rollback()
+
+    def _rollback(self):
+        try:
+            self.connection.rollback()
+        except sqlite3.Error:
+            pass
+
+    def prune(self, roots, seen):
+        """Forgets every file within roots, directories or files, that is not among the filenames seen."""
+        if not self.connection:
+            return
+        self.flush()
+        roots = [os.path.abspath(root) for root in roots]
+        prefixes = tuple(os.path.join(root, '') for root in roots)
+        seen = set(os.path.abspath(filename) for filename in seen)
+        try:
+            stale = [(path, ) for (path, ) in self.connection.execute('SELECT path FROM files')
+                     if path not in seen and (path in roots or path.startswith(prefixes))]
+            if stale:
+                self.connection.executemany('DELETE FROM files WHERE path = ?', stale)
+                self.connection.commit()
+        except sqlite3.Error:
+            self._rollback()
+
+    def close(self):
+        """Writes out anything still held in memory and closes the database."""
+        if not self.connection:
+            return
+        self.flush()
+        try:
+            self.connection.close()
+        except sqlite3.Error:
+            pass
+        self.connection = None
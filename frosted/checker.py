@@ -21,20 +21,35 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import builtins
 import doctest
+import hashlib
 import itertools
+import multiprocessing
 import os
-import pkg_resources
+import pickle
+import select
+import signal
 import sys
+import threading
+import time
+from collections import OrderedDict, deque
 
 from pies import ast
 from pies.overrides import *
 
-from frosted import messages
+from frosted import messages, plugins
 
 PY34_GTE = sys.version_info >= (3, 4)
 FROSTED_BUILTINS = set(dir(builtins) + ['__file__', '__builtins__', '__debug__', '__name__', 'WindowsError',
                                         '__import__'] +
                        os.environ.get('PYFLAKES_BUILTINS', '').split(','))
+MIN_FUNCTIONS_PER_JOB = 100  # Fewer function bodies than this per process are not worth forking for
+FUNCTION_JOB_SECONDS = 120  # How long forked copies have to report back before they are assumed stuck and killed
+DOCTEST_CACHE_SIZE = 4096  # How many parsed docstrings are kept, for processes that see the same ones repeatedly
+FORK_NODES = (ast.If, ast.Try, ast.TryFinally)  # Statements whose children are recorded in the fork path of each node
+
+_doctest_parser = doctest.DocTestParser()
+_doctest_cache = OrderedDict()
+_doctest_lock = threading.Lock()
 
 def node_name(node):
     """
@@ -173,6 +188,91 @@ class ModuleScope(Scope):
     pass
 
 
+class _RecordingScope(Scope):
+    """A copy of a scope, sharing its bindings, that records every name looked up in it. See _recording."""
+
+    def __init__(self, scope):
+        Scope.__init__(self, scope)
+        self.importStarred = scope.importStarred
+        self.looked_up = set()
+
+    def __getitem__(self, name):
+        self.looked_up.add(name)
+        return Scope.__getitem__(self, name)
+
+    def __contains__(self, name):
+        self.looked_up.add(name)
+        return Scope.__contains__(self, name)
+
+    def get(self, name, default=None):
+        self.looked_up.add(name)
+        return Scope.get(self, name, default)
+
+
+_recording_classes = {}
+
+
+def _recording(scope):
+    """Returns a _RecordingScope copy of scope, which is still an instance of the same kind of scope."""
+    scope_class = scope.__class__
+    if scope_class not in _recording_classes:
+        _recording_classes[scope_class] = type(str('Recording' + scope_class.__name__),
+                                               (_RecordingScope, scope_class), {})
+    return _recording_classes[scope_class](scope)
+
+
+def _ancestry(node):
+    ancestry = []
+    while node is not None:
+        ancestry.append(node.__class__.__name__)
+        node = getattr(node, 'parent', None)
+    return tuple(ancestry)
+
+
+def _describe(binding):
+    """Returns everything about binding that checking a function body looking it up might depend on."""
+    if binding is None:
+        return None
+    signature = getattr(binding, 'signature', None)
+    return (binding.__class__.__name__, bool(binding.used), getattr(binding, 'fullName', None),
+            getattr(binding.source, 'lineno', None), getattr(binding.source, 'col_offset', None),
+            _ancestry(binding.source), signature and tuple(getattr(signature, name) for name in signature.__slots__))
+
+
+def _renumber(share, index):
+    """Moves a share found for one top-level body, see Checker.run_deferred_share, to the top-level position index."""
+    def renumber(order):
+        return order[:1] + ((index, ) + order[1][1:], ) + order[2:]
+    found, first_uses = share
+    return ([((order[0], ) + renumber(order[1:]), message, condition and (condition[0], renumber(condition[1])))
+             for order, message, condition in found],
+            dict((name, renumber(order)) for name, order in itemsview(first_uses)))
+
+
+class Incremental(object):
+    """Remembers what checking each top-level function body found, so that checking a module again only checks the
+    bodies that have changed since, see Checker.run_deferred_incrementally.
+
+    Meant for long running sessions that check the same modules over and over as they are edited. reused and checked
+    count the bodies that were and were not found unchanged.
+
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.reused = 0
+        self.checked = 0
+
+    def bodies(self, filename, context):
+        """Returns what was remembered about the bodies of filename, if it was last checked in the same context."""
+        remembered_context, bodies = self.files.get(filename, (None, {}))
+        return bodies if remembered_context == context else {}
+
+    def remember(self, filename, context, bodies):
+        """Replaces what is remembered about the bodies of filename with bodies."""
+        self.files[filename] = (context, bodies)
+
+
 class FunctionSignature(object):
     __slots__ = ('decorated', 'argument_names', 'default_count', 'kw_only_argument_names', 'default_count',
                  'kw_only_argument_names', 'kw_only_default_count', 'has_var_arg', 'has_kw_arg')
@@ -235,22 +335,99 @@ class FunctionSignature(object):
             return reporter.report(messages.NeedKwOnlyArgument, call_node, name, ', '.join(missing_arguments))
 
 
+def _doctest_examples(docstring):
+    """Returns the (source, lineno, indent) of each example in docstring, along with the line each starts on once all
+    their sources are joined together, or None if joining them would change their meaning, and the tree of the joined
+    sources if it was compiled just now to find out.
+
+    Parsed docstrings are cached by their hash, but not their trees, as checking a tree changes it.
+
+    """
+    key = hashlib.sha1(docstring.encode('utf-8')).digest()
+    with _doctest_lock:
+        cached = _doctest_cache.pop(key, None)
+        if cached:
+            _doctest_cache[key] = cached
+            return cached + (None, )
+
+    examples = tuple((example.source, example.lineno, example.indent)
+                     for example in _doctest_parser.get_examples(docstring))
+    starts, line = [], 1
+    for source, lineno, indent in examples:
+        starts.append(line)
+        line += source.count('\n')
+    try:
+        tree = compile(''.join(source for source, lineno, indent in examples), "<doctest>", "exec",
+                       ast.PyCF_ONLY_AST)
+    except SyntaxError:
+        tree = None
+    if tree is None or not set(starts).issubset(statement.lineno for statement in tree.body):
+        # Some example does not compile alone, or only does so joined to another, so each has to be compiled alone
+        tree = starts = None
+
+    with _doctest_lock:
+        _doctest_cache[key] = (examples, starts)
+        while len(_doctest_cache) > DOCTEST_CACHE_SIZE:
+            _doctest_cache.popitem(last=False)
+    return examples, starts, tree
+
+
+def _fork(function, *args):
+    """Runs function(*args) in a forked copy of this process.
+
+    Returns the process id of the copy along with a file that the pickled return value can be read from.
+
+    """
+    read_end, write_end = os.pipe()
+    process_id = os.fork()
+    if not process_id:
+        status = 1
+        try:
+            os.close(read_end)
+            with os.fdopen(write_end, 'wb') as stream:
+                pickle.dump(function(*args), stream, pickle.HIGHEST_PROTOCOL)
+            status = 0
+        finally:
+            os._exit(status)
+    os.close(write_end)
+    return process_id, os.fdopen(read_end, 'rb')
+
+
+def _read_until(stream, deadline):
+    """Returns everything written to stream until its writer closed it, or None if that has not happened by the
+    time.time() given as deadline."""
+    data = []
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0 or not select.select([stream], [], [], remaining)[0]:
+            return None
+        chunk = os.read(stream.fileno(), 65536)
+        if not chunk:
+            return b''.join(data)
+        data.append(chunk)
+
+
+def _only_thread():
+    """Returns whether this is the main thread, with no others running that could hold a lock across a fork."""
+    return isinstance(threading.current_thread(), threading._MainThread) and threading.active_count() == 1
+
+
 class Checker(object):
     """The core of frosted, checks the cleanliness and sanity of Python code."""
 
-    node_depth = 0
-    offset = None
     trace_tree = False
     frosted_builtins = FROSTED_BUILTINS
 
-    def __init__(self, tree, filename='(none)', builtins=None, ignore_lines=(), **settings):
+    def __init__(self, tree, filename='(none)', builtins=None, ignore_lines=(), incremental=None, **settings):
         self.settings = settings
-        self.ignore_errors = settings.get('ignore_frosted_errors', [])
+        self.ignore_errors = list(settings.get('ignore_frosted_errors', []))
         self.ignore_lines = ignore_lines
         file_specific_ignores = settings.get('ignore_frosted_errors_for_' + (os.path.basename(filename) or ""), None)
         if file_specific_ignores:
-            self.ignore_errors += file_specific_ignores
+            self.ignore_errors.extend(file_specific_ignores)
 
+        self.node_depth = 0
+        self.offset = None
         self._node_handlers = {}
         self._deferred_functions = []
         self._deferred_assignments = []
@@ -263,39 +440,47 @@ class Checker(object):
         self.except_handlers = [()]
         self.futures_allowed = True
         self.root = tree
+        self._shared_scope = None
         self.handle_children(tree)
-        self.run_deferred(self._deferred_functions)
+        if incremental is None:
+            shares = self.run_deferred_in_processes(self.function_jobs())
+        else:
+            shares = self.run_deferred_incrementally(incremental)
+        if shares is None:
+            self.run_deferred(self._deferred_functions)
         self._deferred_functions = None
-        self.run_deferred(self._deferred_assignments)
+        if shares is None:
+            self.run_deferred(self._deferred_assignments)
         self._deferred_assignments = None
         del self.scope_stack[1:]
         self.pop_scope()
-        self.check_dead_scopes()
+        if shares is None:
+            self.check_dead_scopes()
+        else:
+            self.merge_shares(shares)
         self.check_plugins()
 
     def check_plugins(self):
-        """ collect plugins from entry point 'frosted.plugins'
+        """ run the check() method of every plugin enabled by the settings, passing the filename
 
-        and run their check() method, passing the filename
+        plugins are found and loaded through the process wide frosted.plugins.registry
         """
-        checkers = {}
-        for ep in pkg_resources.iter_entry_points(group='frosted.plugins'):
-            checkers.update({ep.name: ep.load()})
-
-        for plugin_name, plugin in checkers.items():
-            if self.filename != '(none)':
-                messages = plugin.check(self.filename)
-                for message, loc, args, kwargs in messages:
-                    self.report(message, loc, *args, **kwargs)
+        if self.filename == '(none)':
+            return
+        for plugin_name in plugins.registry.enabled(self.settings):
+            messages = plugins.registry.load(plugin_name).check(self.filename)
+            for message, loc, args, kwargs in messages:
+                self.report(message, loc, *args, **kwargs)
 
-    def defer_function(self, callable):
+    def defer_function(self, callable, node=None):
         """Schedule a function handler to be called just before completion.
 
         This is used for handling function bodies, which must be deferred because code later in the file might modify
         the global scope. When 'callable' is called, the scope at the time this is called will be restored, however it
-        will contain any new bindings added to it.
+        will contain any new bindings added to it. node is the one callable checks, if only that one.
 
         """
+        callable.node = node
         self._deferred_functions.append((callable, self.scope_stack[:], self.offset))
 
     def defer_assignment(self, callable):
@@ -310,6 +495,165 @@ class Checker(object):
             self.offset = offset
             handler()
 
+    def function_jobs(self):
+        """Returns how many processes the deferred function bodies should be split between, 1 for none at all."""
+        jobs = self.settings.get('function_jobs', 1)
+        if not jobs or jobs < 0:
+            jobs = multiprocessing.cpu_count()
+        if not hasattr(os, 'fork') or not _only_thread():
+            # A copy forked while another thread holds a lock, such as the import lock, would wait on it forever
+            return 1
+        return max(1, min(jobs, len(self._deferred_functions) // MIN_FUNCTIONS_PER_JOB))
+
+    def run_deferred_in_processes(self, jobs):
+        """Runs the deferred function bodies in jobs forked copies of this checker, returning what each one found.
+
+        Once the module level has been checked, function bodies only read the module scope, apart from marking the
+        names they use. Each copy takes its share of the top-level bodies, along with any bodies nested in them, and
+        reports its messages with their place in the order a serial run would have produced them, see merge_shares.
+        Returns None, leaving this checker untouched, if jobs is 1 or any of the copies failed or had not finished
+        within FUNCTION_JOB_SECONDS.
+
+        """
+        if jobs <= 1:
+            return None
+        deferred = [((index, ), entry) for index, entry in enumerate(self._deferred_functions)]
+        children = [_fork(self.run_deferred_share, deferred[job::jobs]) for job in range(jobs)]
+        deadline = time.time() + FUNCTION_JOB_SECONDS
+        shares = []
+        for process_id, stream in children:
+            with stream:
+                data = _read_until(stream, deadline) if shares is not None else None
+            if data is None:
+                os.kill(process_id, signal.SIGKILL)
+            if os.waitpid(process_id, 0)[1] == 0 and data is not None and shares is not None:
+                shares.append(pickle.loads(data))
+            else:
+                shares = None
+        return shares
+
+    def run_deferred_incrementally(self, incremental):
+        """Runs the deferred function bodies one top-level body at a time, returning what each found as a share for
+        merge_shares, but reusing what incremental remembers for each body that has not changed.
+
+        A body is unchanged if its tree, position and noqa lines are the same, as is everything about the names it
+        looked up in the module and class scopes around it, as they were before any body was checked. Apart from
+        marking names used, which merge_shares accounts for, bodies leave those scopes alone.
+
+        """
+        context = repr((sorted((key, repr(value)) for key, value in itemsview(self.settings)),
+                        sorted(self.frosted_builtins)))
+        remembered, bodies = incremental.bodies(self.filename, context), {}
+        messages, dead_scopes = self.messages, self.dead_scopes
+        shares = []
+        for index, (handler, scope_stack, offset) in enumerate(self._deferred_functions):
+            outer_scopes = list(itertools.takewhile(lambda scope: not isinstance(scope, FunctionScope), scope_stack))
+            fingerprint = self.fingerprint(handler, offset, len(outer_scopes))
+            body = remembered.get(fingerprint)
+            if body and body[0] == self.describe_looked_up(outer_scopes, [names for names, described in body[0]]):
+                incremental.reused += 1
+                shares.append(_renumber(body[1], index))
+                bodies[fingerprint] = body
+                continue
+
+            incremental.checked += 1
+            used = [dict((name, binding.used) for name, binding in itemsview(scope)) for scope in outer_scopes]
+            recording = [_recording(scope) for scope in outer_scopes]
+            self.messages, self.dead_scopes = [], []
+            share = self.run_deferred_share([((index, ), (handler, recording + scope_stack[len(recording):], offset))],
+                                            recording[0])
+            self.messages, self.dead_scopes = messages, dead_scopes
+            for scope, scope_used in zip(outer_scopes, used):
+                for name, binding in itemsview(scope):
+                    binding.used = scope_used[name]
+            shares.append(share)
+            if fingerprint:
+                bodies[fingerprint] = (self.describe_looked_up(outer_scopes, [scope.looked_up for scope in recording]),
+                                       share)
+        self._shared_scope = None
+        incremental.remember(self.filename, context, bodies)
+        return shares
+
+    def fingerprint(self, handler, offset, depth):
+        """Returns what identifies a deferred function body, or None if it can not be told apart from others."""
+        node = handler.node
+        if node is None:
+            return None
+        lines = [child.lineno for child in ast.walk(node) if hasattr(child, 'lineno')]
+        digest = hashlib.sha1(ast.dump(node, include_attributes=True).encode('utf-8')).hexdigest()
+        return (handler.__name__, digest, offset, depth,
+                tuple(line for line in self.ignore_lines if min(lines) <= line <= max(lines)))
+
+    def describe_looked_up(self, scopes, looked_up):
+        """Returns the description of every name in looked_up, one collection of names per scope in scopes."""
+        return tuple((frozenset(names), (scope.importStarred, tuple((name, _describe(scope.get(name)))
+                                                                    for name in sorted(names))))
+                     for scope, names in zip(scopes, looked_up))
+
+    def run_deferred_share(self, share, shared_scope=None):
+        """Runs a share of the deferred function bodies, as (key, (callable, scope, offset)) pairs, in this process.
+
+        Returns every message found, as (serial order, message, condition) triples, along with the serial order at
+        which each module level name was first used. A condition of (name, serial order) marks a message that a
+        serial run would only have reported if name had not been used by then. shared_scope stands in for the
+        module scope, if the bodies were given a copy of it.
+
+        """
+        self._shared_scope = shared_scope or self.scope_stack[0]
+        self._first_uses = {}
+        self._conditions = {}
+        found, assignments, dead_scopes = [], [], []
+
+        def collect(phase, order, start):
+            for index, message in enumerate(self.messages[start:]):
+                condition = self._conditions.pop(start + index, None)
+                found.append(((phase, ) + order + (index, ), message, condition and (condition, order)))
+
+        pending = deque(share)
+        while pending:
+            key, entry = pending.popleft()
+            self._order = order = (len(key), key)
+            self._deferred_functions, self._deferred_assignments = [], []
+            start, dead_start = len(self.messages), len(self.dead_scopes)
+            self.run_deferred([entry])
+            collect(0, order, start)
+            pending.extend((key + (index, ), nested) for index, nested in enumerate(self._deferred_functions))
+            assignments.extend((order + (index, ), assignment)
+                               for index, assignment in enumerate(self._deferred_assignments))
+            dead_scopes.extend((order + (index, ), scope) for index, scope in enumerate(self.dead_scopes[dead_start:]))
+
+        for order, assignment in assignments:
+            start = len(self.messages)
+            self.run_deferred([assignment])
+            collect(1, order, start)
+        for order, scope in dead_scopes:
+            start = len(self.messages)
+            self.check_dead_scopes([scope])
+            collect(2, order, start)
+        return found, self._first_uses
+
+    def merge_shares(self, shares):
+        """Merges what run_deferred_in_processes found into this checker, in the order a serial run would have."""
+        first_uses = {}
+        for found, share_first_uses in shares:
+            for name, order in itemsview(share_first_uses):
+                first_uses[name] = min(order, first_uses.get(name, order))
+
+        found = sorted((item for share_found, share_first_uses in shares for item in share_found),
+                       key=lambda item: item[0])
+        module_scope = self.dead_scopes.pop()
+        for name in first_uses:
+            module_scope[name].used = (module_scope, None)
+
+        for order, message, condition in found:
+            if order[0] == 2:
+                break
+            if not condition or not condition[0] in first_uses or first_uses[condition[0]] >= condition[1]:
+                self.messages.append(message)
+        self.check_dead_scopes()
+        self.messages.extend(message for order, message, condition in found if order[0] == 2)
+        self.check_dead_scopes([module_scope])
+
     @property
     def scope(self):
         return self.scope_stack[-1]
@@ -317,10 +661,10 @@ class Checker(object):
     def pop_scope(self):
         self.dead_scopes.append(self.scope_stack.pop())
 
-    def check_dead_scopes(self):
+    def check_dead_scopes(self, scopes=None):
         """Look at scopes which have been fully examined and report names in
         them which were imported but unused."""
-        for scope in self.dead_scopes:
+        for scope in self.dead_scopes if scopes is None else scopes:
             export = isinstance(scope.get('__all__'), ExportBinding)
             if export:
                 all = scope['__all__'].names()
@@ -388,21 +732,24 @@ class Checker(object):
 
     def different_forks(self, lnode, rnode):
         """True, if lnode and rnode are located on different forks of
-        IF/TRY."""
-        ancestor = self.get_common_ancestor(lnode, rnode)
-        if isinstance(ancestor, ast.If):
-            for fork in (ancestor.body, ancestor.orelse):
-                if self.on_fork(ancestor, lnode, rnode, fork):
-                    return True
-        elif isinstance(ancestor, ast.Try):
-            body = ancestor.body + ancestor.orelse
-            for fork in [body] + [[hdl] for hdl in ancestor.handlers]:
-                if self.on_fork(ancestor, lnode, rnode, fork):
-                    return True
-        elif isinstance(ancestor, ast.TryFinally):
-            if self.on_fork(ancestor, lnode, rnode, ancestor.body):
+        IF/TRY.
+
+        Compares the fork paths handleNode records, so that nodes can be told apart by the first If or Try they
+        are on different sides of, without walking up the tree.
+
+        """
+        lforks, rforks = getattr(lnode, 'forks', None), getattr(rnode, 'forks', None)
+        if lforks is None or rforks is None:
+            return False
+        for (lfork, rfork) in zip(lforks, rforks):
+            if lfork[0] is not rfork[0]:
+                return False
+            if lfork[1] != rfork[1]:
                 return True
-        return False
+        # One node contains the other, which only counts if it is the If or Try holding the other on a fork
+        if len(lforks) > len(rforks):
+            lnode, lforks, rforks = rnode, rforks, lforks
+        return len(rforks) > len(lforks) and rforks[len(lforks)][0] is lnode and rforks[len(lforks)][1] is not None
 
     def add_binding(self, node, value, report_redef=True):
         """Called when a binding is altered.
@@ -425,8 +772,12 @@ class Checker(object):
                         and report_redef
                         and not self.different_forks(node, existing.source)):
                     redefinedWhileUnused = True
+                    reported = len(self.messages)
                     self.report(messages.RedefinedWhileUnused,
                                 node, value.name, existing.source)
+                    if scope is self._shared_scope and len(self.messages) > reported:
+                        # Another process may use the name first, see run_deferred_share
+                        self._conditions[reported] = value.name
 
         existing = self.scope.get(value.name)
         if not redefinedWhileUnused and self.has_parent(value.source, ast.ListComp):
@@ -475,6 +826,8 @@ class Checker(object):
             except KeyError:
                 pass
             else:
+                if scope is self._shared_scope:
+                    self._first_uses.setdefault(name, self._order)
                 return
 
         # look in the built-ins
@@ -551,7 +904,14 @@ class Checker(object):
         doctest_lineno = node.lineno - node.s.count('\n') - 1
         return (node.s, doctest_lineno)
 
-    def handleNode(self, node, parent):
+    def handleNode(self, node, parent, fork=None):
+        """Checks node, found within parent.
+
+        When parent is an If or Try, fork tells which alternative node is on: 0 for the body, or for a Try its
+        else clause too, 1 onwards for each except clause, and None for anything else such as the test or finally
+        clause. Every node records as its forks the (If or Try, fork) pairs of all the statements containing it.
+
+        """
         if node is None:
             return
         if self.offset and getattr(node, 'lineno', None) is not None:
@@ -565,6 +925,9 @@ class Checker(object):
         self.node_depth += 1
         node.level = self.node_depth
         node.parent = parent
+        node.forks = getattr(parent, 'forks', ())
+        if isinstance(parent, FORK_NODES):
+            node.forks += ((parent, fork), )
         try:
             handler = self.get_node_handler(node.__class__)
             handler(node)
@@ -573,32 +936,40 @@ class Checker(object):
         if self.trace_tree:
             print('  ' * self.node_depth + 'end ' + node.__class__.__name__)
 
-    _get_doctest_examples = doctest.DocTestParser().get_examples
-
     def handle_doctests(self, node):
         try:
             docstring, node_lineno = self.docstring(node.body[0])
-            if not docstring:
+            if not docstring or '>>>' not in docstring:
                 return
-            examples = self._get_doctest_examples(docstring)
+            examples, starts, tree = _doctest_examples(docstring)
         except (ValueError, IndexError):
             # e.g. line 6 of the docstring for <string> has inconsistent
             # leading whitespace: ...
             return
         node_offset = self.offset or (0, 0)
         self.push_scope()
-        for example in examples:
-            try:
-                tree = compile(example.source, "<doctest>", "exec", ast.PyCF_ONLY_AST)
-            except SyntaxError:
-                e = sys.exc_info()[1]
-                position = (node_lineno + example.lineno + e.lineno,
-                            example.indent + 4 + (e.offset or 0))
-                self.report(messages.DoctestSyntaxError, node, position)
-            else:
-                self.offset = (node_offset[0] + node_lineno + example.lineno,
-                               node_offset[1] + example.indent + 4)
-                self.handle_children(tree)
+        if starts is None:
+            for source, lineno, indent in examples:
+                try:
+                    tree = compile(source, "<doctest>", "exec", ast.PyCF_ONLY_AST)
+                except SyntaxError:
+                    e = sys.exc_info()[1]
+                    position = (node_lineno + lineno + e.lineno, indent + 4 + (e.offset or 0))
+                    self.report(messages.DoctestSyntaxError, node, position)
+                else:
+                    self.offset = (node_offset[0] + node_lineno + lineno, node_offset[1] + indent + 4)
+                    self.handle_children(tree)
+                    self.offset = node_offset
+        else:
+            # Every example compiled in one pass, each one's statements moved back to its own lines
+            if tree is None:
+                tree = compile(''.join(source for source, lineno, indent in examples), "<doctest>", "exec",
+                               ast.PyCF_ONLY_AST)
+            statements = deque(tree.body)
+            for (source, lineno, indent), start, end in zip(examples, starts, starts[1:] + [float('inf')]):
+                self.offset = (node_offset[0] + node_lineno + lineno - start + 1, node_offset[1] + indent + 4)
+                while statements and statements[0].lineno < end:
+                    self.handleNode(statements.popleft(), tree)
                 self.offset = node_offset
         self.pop_scope()
 
@@ -636,7 +1007,7 @@ class Checker(object):
         pass
 
     # "stmt" type nodes
-    RETURN = DELETE = PRINT = WHILE = IF = WITH = WITHITEM = RAISE = TRYFINALLY = ASSERT = EXEC = EXPR = handle_children
+    RETURN = DELETE = PRINT = WHILE = WITH = WITHITEM = RAISE = ASSERT = EXEC = EXPR = handle_children
 
     CONTINUE = BREAK = PASS = ignore
 
@@ -751,7 +1122,7 @@ class Checker(object):
         self.add_binding(node, FunctionDefinition(node.name, node))
         self.LAMBDA(node)
         if self.settings.get('run_doctests', False):
-            self.defer_function(lambda: self.handle_doctests(node))
+            self.defer_function(lambda: self.handle_doctests(node), node)
 
     def LAMBDA(self, node):
         args = []
@@ -832,7 +1203,7 @@ class Checker(object):
                 self.defer_assignment(checkReturnWithArgumentInsideGenerator)
             self.pop_scope()
 
-        self.defer_function(runFunction)
+        self.defer_function(runFunction, node)
 
     def CLASSDEF(self, node):
         """Check names used in a class definition, including its decorators,
@@ -850,7 +1221,7 @@ class Checker(object):
                 self.handleNode(keywordNode, node)
         self.push_scope(ClassScope)
         if self.settings.get('run_doctests', False):
-            self.defer_function(lambda: self.handle_doctests(node))
+            self.defer_function(lambda: self.handle_doctests(node), node)
         for stmt in node.body:
             self.handleNode(stmt, node)
         self.pop_scope()
@@ -891,6 +1262,13 @@ class Checker(object):
                 importation.used = (self.scope, node)
             self.add_binding(node, importation)
 
+    def IF(self, node):
+        self.handleNode(node.test, node)
+        for child in node.body:
+            self.handleNode(child, node, 0)
+        for child in node.orelse:
+            self.handleNode(child, node, 1)
+
     def TRY(self, node):
         handler_names = []
         # List the exception handlers
@@ -903,15 +1281,24 @@ class Checker(object):
         # Memorize the except handlers and process the body
         self.except_handlers.append(handler_names)
         for child in node.body:
-            self.handleNode(child, node)
+            self.handleNode(child, node, 0)
         self.except_handlers.pop()
         # Process the other nodes: "except:", "else:", "finally:"
-        for child in ast.iter_child_nodes(node):
-            if child not in node.body:
-                self.handleNode(child, node)
+        for fork, handler in enumerate(node.handlers, 1):
+            self.handleNode(handler, node, fork)
+        for child in node.orelse:
+            self.handleNode(child, node, 0)
+        for child in getattr(node, 'finalbody', ()):
+            self.handleNode(child, node)
 
     TRYEXCEPT = TRY
 
+    def TRYFINALLY(self, node):
+        for child in node.body:
+            self.handleNode(child, node, 0)
+        for child in node.finalbody:
+            self.handleNode(child, node)
+
     def EXCEPTHANDLER(self, node):
         # 3.x: in addition to handling children, we must handle the name of
         # the exception, which is not a Name node, but a simple string.
@@ -0,0 +1,79 @@
+"""frosted/client.py.
+
+Defines a thin client for a running `frosted --daemon`. It deliberately imports nothing beyond the standard library
+so that checking a file through the daemon costs little more than starting the interpreter.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and
+to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import os
+import socket
+import sys
+
+__all__ = ['request', 'socket_path', 'main']
+
+
+def socket_path():
+    """Returns the Unix socket the daemon listens on unless told otherwise."""
+    return os.environ.get('FROSTED_SOCKET') or os.path.join(os.environ.get('XDG_RUNTIME_DIR') or
+                                                           os.path.expanduser('~'), '.frosted.sock')
+
+
+def request(argv, stdin=None, path=None):
+    """Runs the frosted command line argv inside the daemon, returning its (stdout, stderr, exit status).
+
+    A reply that is missing or can not be understood, as from a daemon that died handling the request, is returned as
+    an error on stderr with an exit status of 1.
+
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path or socket_path())
+        connection.sendall(json.dumps({'argv': argv, 'cwd': os.getcwd(), 'stdin': stdin}).encode('utf-8'))
+        connection.shutdown(socket.SHUT_WR)
+        data = b''.join(iter(lambda: connection.recv(65536), b''))
+    finally:
+        connection.close()
+
+    try:
+        response = json.loads(data.decode('utf-8'))
+        return response['stdout'], response['stderr'], response['status']
+    except (ValueError, KeyError, TypeError):
+        return '', 'frosted: the daemon sent {0} reply\n'.format('an invalid' if data else 'no'), 1
+
+
+def main():
+    argv = sys.argv[1:]
+    stdin = sys.stdin.read() if '-' in argv and '--stream' not in argv else None
+    path = '--socket' in argv[:-1] and argv[argv.index('--socket') + 1] or None
+    try:
+        if '--daemon' in argv or '--stream' in argv or not hasattr(socket, 'AF_UNIX'):
+            raise socket.error()
+        stdout, stderr, status = request(argv, stdin, path)
+    except socket.error:
+        # No daemon to talk to, or a session that has to read stdin itself: check in this process instead
+        from io import StringIO
+        from frosted.main import main as frosted_main
+        frosted_main(argv, stdin=None if stdin is None else StringIO(stdin))
+    else:
+        sys.stdout.write(stdout)
+        sys.stderr.write(stderr)
+        raise SystemExit(status)
+
+
+if __name__ == "__main__":
+    main()
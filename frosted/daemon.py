@@ -0,0 +1,111 @@
+"""frosted/daemon.py.
+
+Defines a long running frosted process that keeps its modules, settings and plugins warm between checks, taking
+command lines from frosted-client over a local Unix socket.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and
+to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import os
+import socket
+import sys
+import traceback
+from io import StringIO
+
+from pies.overrides import *
+
+from frosted import client
+from frosted.main import main
+from frosted.reporter import Reporter
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+__all__ = ['run', 'server', 'serve']
+
+
+def run(argv, cwd, stdin=None):
+    """Runs the frosted command line argv as if started from cwd, returning its (stdout, stderr, exit status).
+
+    Requests are handled one at a time, so the working directory and standard streams can safely be swapped. Anything
+    that goes wrong is reported on stderr, with an exit status of 1, rather than leaving the client without a reply.
+
+    """
+    stdout, stderr = StringIO(), StringIO()
+    original_cwd, original_streams = os.getcwd(), (sys.stdout, sys.stderr)
+    status = 0
+    try:
+        os.chdir(cwd)
+        sys.stdout, sys.stderr = stdout, stderr
+        main(argv, Reporter(stdout, stderr), StringIO(stdin or ''))
+    except SystemExit as exit:
+        if exit.code is None or isinstance(exit.code, int):
+            status = int(exit.code or 0)
+        else:
+            stderr.write('{0}\n'.format(exit.code))
+            status = 1
+    except Exception:
+        stderr.write(traceback.format_exc())
+        status = 1
+    finally:
+        sys.stdout, sys.stderr = original_streams
+        os.chdir(original_cwd)
+    return stdout.getvalue(), stderr.getvalue(), status
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Answers a single frosted-client request."""
+
+    def handle(self):
+        request = json.loads(self.rfile.read().decode('utf-8'))
+        if '--daemon' in request['argv']:
+            stdout, stderr, status = '', 'frosted: the daemon is already running\n', 2
+        else:
+            stdout, stderr, status = run(request['argv'], request['cwd'], request.get('stdin'))
+        self.wfile.write(json.dumps({'stdout': stdout, 'stderr': stderr, 'status': status}).encode('utf-8'))
+
+
+def server(path=None):
+    """Binds a daemon to the Unix socket at path, replacing the socket file if no daemon is listening on it."""
+    path = path or client.socket_path()
+    if os.path.exists(path):
+        try:
+            client.request(['--version'], path=path)
+        except socket.error:
+            os.unlink(path)
+        else:
+            raise SystemExit('frosted: a daemon is already listening on {0}'.format(path))
+
+    old_umask = os.umask(0o077)  # Only the user that started the daemon may talk to it
+    try:
+        return socketserver.UnixStreamServer(path, RequestHandler)
+    finally:
+        os.umask(old_umask)
+
+
+def serve(path=None):
+    """Runs a daemon on the Unix socket at path until interrupted."""
+    daemon = server(path)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.server_close()
+        os.unlink(daemon.server_address)
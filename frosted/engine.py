@@ -0,0 +1,541 @@
+"""frosted/engine.py.
+
+Defines how frosted runs its checks over many files, optionally spreading the work across several processes
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and
+to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import itertools
+import json
+import multiprocessing
+import multiprocessing.pool
+import os
+import select
+import sys
+import threading
+import time
+import zlib
+from collections import deque, namedtuple
+
+from pies.overrides import *
+
+from frosted import reporter as modReporter
+from frosted.messages import OverBudget
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    from multiprocessing.connection import wait
+except ImportError:
+    def wait(connections, timeout=None):
+        return select.select(connections, (), (), timeout)[0]
+
+__all__ = ['History', 'Result', 'check_file', 'prefetch', 'run', 'shard']
+
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                         'frosted')
+DEFAULT_HISTORY_PATH = os.path.join(CACHE_DIR, 'history.json')
+CHUNKS_PER_JOB = 4  # How many chunks of roughly equal cost each worker process should expect to receive
+MAX_CHUNK_FILES = 32  # The most files that will ever be sent to a worker process at once
+MAX_HISTORY_AGE = 30 * 24 * 60 * 60  # How many seconds a file can go unchecked before its history is forgotten
+MAX_HISTORY_FILES = 100000  # The most files a history remembers, those checked least recently being forgotten first
+MAX_READ_AHEAD_THREADS = 4  # The most threads that will be reading files ahead of the checker at once
+MEGABYTE = 1024 * 1024
+WORKER_POLL_SECONDS = 1  # How often worker processes are checked on when no file has a time budget
+
+
+class Result(namedtuple('Result', ('filename', 'warnings', 'messages', 'errors', 'duration'))):
+    """The outcome of checking a single file, in a form that can be sent between processes."""
+
+    def report(self, reporter):
+        """Present the result using the given reporter."""
+        modReporter.Recorder(self.messages, self.errors).replay(reporter)
+
+    def renamed(self, filename):
+        """Returns the result as it would have been for an identical file called filename."""
+        prefix = self.filename
+        messages = [message._replace(message=filename + message.message[len(prefix):])
+                    if message.message.startswith(prefix) else message for message in self.messages]
+        errors = [(filename if name == prefix else name, error) for name, error in self.errors]
+        return Result(filename, self.warnings, messages, errors, 0)
+
+
+class _Pending(object):
+    """A value that one thread promises to another."""
+    __slots__ = ('item', 'value', 'error', 'ready')
+
+    def __init__(self, item):
+        self.item = item
+        self.value = self.error = None
+        self.ready = threading.Event()
+
+
+def prefetch(function, items, depth, threads=None):
+    """Yields (item, function(item)) for every item, in order, computing up to depth results ahead in threads."""
+    threads = threads or min(depth, MAX_READ_AHEAD_THREADS)
+    ordered, work = queue.Queue(depth), queue.Queue()
+    stopped = threading.Event()
+
+    def offer(pending):
+        while not stopped.is_set():
+            try:
+                ordered.put(pending, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                pending = _Pending(item)
+                work.put(pending)
+                if not offer(pending):
+                    return
+        except Exception as exception:
+            pending = _Pending(None)
+            pending.error = exception
+            pending.ready.set()
+            offer(pending)
+        else:
+            offer(None)
+        finally:
+            for thread in range(threads):
+                work.put(None)
+
+    def consume():
+        for pending in iter(work.get, None):
+            try:
+                pending.value = function(pending.item)
+            except Exception as exception:
+                pending.error = exception
+            pending.ready.set()
+
+    for target in [produce] + [consume] * threads:
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+
+    try:
+        for pending in iter(ordered.get, None):
+            pending.ready.wait()
+            if pending.error is not None:
+                raise pending.error
+            yield pending.item, pending.value
+    finally:
+        stopped.set()
+
+
+def shard(paths, index, count):
+    """Yields the paths that belong to shard index (counting from 1) of count.
+
+    Paths are assigned by a hash of their location relative to the working directory, so every machine with the same
+    checkout agrees on which files belong to each shard, no matter where it is checked out or how files are listed.
+
+    """
+    for path in paths:
+        key = os.path.relpath(path).replace(os.sep, '/').encode('utf-8')
+        if zlib.crc32(key) % count == index - 1:
+            yield path
+
+
+class History(object):
+    """Remembers how long each file took to check, so that the most expensive files can be started first.
+
+    Files that have never been checked are estimated from their size, at the rate seen for the files that have been.
+    Without a path, nothing is loaded or saved and all estimates are based on size. Files that have not been checked
+    for MAX_HISTORY_AGE seconds are forgotten when the history is saved, as are the least recently checked beyond
+    MAX_HISTORY_FILES, so that histories shared by many short lived workspaces do not grow forever.
+
+    """
+    default_seconds_per_byte = 0.000002
+
+    def __init__(self, path=None):
+        self.path = path
+        self.files = {}
+        if path:
+            now = time.time()
+            try:
+                with open(path) as history_file:
+                    self.files = dict((filename, (entry[0], entry[1], entry[2] if len(entry) > 2 else now))
+                                      for filename, entry in itemsview(json.load(history_file)['files']))
+            except (IOError, OSError, ValueError, KeyError, TypeError, IndexError, AttributeError):
+                self.files = {}
+
+        total_size = sum(entry[0] for entry in self.files.values())
+        total_duration = sum(entry[1] for entry in self.files.values())
+        self.seconds_per_byte = total_size and total_duration / total_size or self.default_seconds_per_byte
+
+    def estimate(self, filename, size):
+        """Returns how many seconds checking filename is expected to take."""
+        known = self.files.get(os.path.abspath(filename))
+        if not known:
+            return size * self.seconds_per_byte
+        known_size, known_duration = known[:2]
+        return known_size and known_duration * size / known_size or known_duration
+
+    def record(self, filename, size, duration):
+        self.files[os.path.abspath(filename)] = (size, duration, time.time())
+
+    def prune(self):
+        """Forgets the files checked too long ago, or least recently beyond MAX_HISTORY_FILES."""
+        oldest = time.time() - MAX_HISTORY_AGE
+        recent = sorted(((entry[2], filename) for filename, entry in itemsview(self.files) if entry[2] >= oldest),
+                        reverse=True)[:MAX_HISTORY_FILES]
+        self.files = dict((filename, self.files[filename]) for checked, filename in recent)
+
+    def save(self):
+        """Writes the history back to its path, replacing the previous version all at once."""
+        if not self.path:
+            return
+        self.prune()
+        temporary_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            with open(temporary_path, 'w') as history_file:
+                json.dump({'files': self.files}, history_file)
+            getattr(os, 'replace', os.rename)(temporary_path, self.path)
+        except (IOError, OSError):
+            pass
+
+
+def _file_size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+def _schedule(paths, jobs, history):
+    """Groups paths into chunks for worker processes, most expensive first, with cheap files packed together.
+
+    Returns the chunks, as lists of (position, path) pairs, along with the size of every path.
+
+    """
+    sizes = [_file_size(path) for path in paths]
+    costs = [history.estimate(path, size) for path, size in zip(paths, sizes)]
+    target_cost = sum(costs) / (jobs * CHUNKS_PER_JOB)
+    chunks, current, current_cost = [], [], 0
+    for position in sorted(range(len(paths)), key=costs.__getitem__, reverse=True):
+        if current and (current_cost >= target_cost > 0 or len(current) >= MAX_CHUNK_FILES):
+            chunks.append(current)
+            current, current_cost = [], 0
+        current.append((position, paths[position]))
+        current_cost += costs[position]
+    if current:
+        chunks.append(current)
+    return chunks, sizes
+
+
+def check_file(read, check, filename, settings_path, setting_overrides):
+    """Reads and checks a single file, returning its Result."""
+    started = time.time()
+    return _result(check, filename, read(filename), settings_path, setting_overrides, started)
+
+
+def _result(check, filename, source, settings_path, setting_overrides, started):
+    recorder = modReporter.Recorder()
+    warnings = check(filename, source, recorder, settings_path, **setting_overrides)
+    return Result(filename, warnings, recorder.messages, recorder.errors, time.time() - started)
+
+
+def _check_chunk(task):
+    read, check, chunk, settings_path, setting_overrides = task
+    return [(position, check_file(read, check, filename, settings_path, setting_overrides))
+            for position, filename in chunk]
+
+
+def _check_serially(read, check, chunk, read_ahead, settings_path, setting_overrides):
+    """Checks each (position, path) of chunk in turn, yielding a batch of one (position, Result) pair for each, with
+    up to read_ahead files read by background threads in the meantime."""
+    paths = [path for position, path in chunk]
+    sources = prefetch(read, paths, read_ahead) if read_ahead else ((path, read(path)) for path in paths)
+    try:
+        for (position, path), (_, source) in zip(chunk, sources):
+            yield [(position, _result(check, path, source, settings_path, setting_overrides, time.time()))]
+    finally:
+        sources.close()
+
+
+def _peak_memory():
+    """Returns the most memory, in bytes, this process has had resident at once."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _work(connection, read, check, settings_path, setting_overrides, memory_limit, recycle_after, recycle_memory):
+    """The main loop of a worker process, checking each chunk of files it is sent until told to stop or retiring.
+
+    A (position, Result) pair is sent back for every file, with None in place of the Result for files that ran out
+    of memory, and a (None, retiring) pair after every chunk.
+
+    """
+    if memory_limit and resource:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit * MEGABYTE, memory_limit * MEGABYTE))
+    checked = 0
+    for chunk in iter(connection.recv, None):
+        for position, filename in chunk:
+            try:
+                result = check_file(read, check, filename, settings_path, setting_overrides)
+            except MemoryError:
+                connection.send((position, None))
+                return
+            connection.send((position, result))
+        checked += len(chunk)
+        retiring = bool(recycle_after and checked >= recycle_after or
+                        recycle_memory and resource and _peak_memory() >= recycle_memory * MEGABYTE)
+        connection.send((None, retiring))
+        if retiring:
+            return
+
+
+class _Worker(object):
+    """A worker process, as seen by the process handing it work."""
+    __slots__ = ('process', 'connection', 'chunk', 'started')
+
+    def __init__(self, arguments):
+        self.connection, worker_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_work, args=(worker_connection, ) + arguments)
+        self.process.daemon = True
+        self.process.start()
+        worker_connection.close()
+        self.chunk = None
+        self.started = None
+
+    def assign(self, chunk):
+        self.chunk = list(chunk)
+        self.started = time.time()
+        self.connection.send(self.chunk)
+
+    def stop(self, kill=False):
+        if kill:
+            self.process.terminate()
+        else:
+            try:
+                self.connection.send(None)
+            except (IOError, OSError):
+                pass
+        self.process.join()
+        self.connection.close()
+
+
+def _supervise(read, check, chunks, jobs, settings_path, setting_overrides, time_limit=None, memory_limit=None,
+               recycle_after=None, recycle_memory=None):
+    """Checks chunks of files in up to jobs worker processes, yielding lists of (position, Result) as files finish.
+
+    Any file still being checked time_limit seconds after it was started has its worker killed, and is reported as
+    over budget, as is any file that takes a worker above memory_limit megabytes. Workers retire once they have
+    checked recycle_after files or their peak memory use has reached recycle_memory megabytes, with new workers
+    taking over the remaining chunks.
+
+    """
+    arguments = (read, check, settings_path, setting_overrides, memory_limit, recycle_after, recycle_memory)
+    pending, workers = deque(chunks), {}
+
+    def abandon(worker, budget):
+        del workers[worker.connection]
+        worker.stop(kill=budget == 'time')
+        if not worker.chunk:
+            return []
+        position, filename = worker.chunk.pop(0)
+        if worker.chunk:
+            pending.appendleft(worker.chunk)
+        if budget:
+            messages = [OverBudget(filename, None, budget, verbose=setting_overrides.get('verbose'))]
+            return [(position, Result(filename, 1, messages, [], time.time() - worker.started))]
+        errors = [(filename, 'the worker process checking it stopped unexpectedly')]
+        return [(position, Result(filename, 1, [], errors, time.time() - worker.started))]
+
+    try:
+        while pending or workers:
+            while pending and len(workers) < jobs:
+                worker = _Worker(arguments)
+                workers[worker.connection] = worker
+                worker.assign(pending.popleft())
+
+            timeout = WORKER_POLL_SECONDS
+            if time_limit:
+                deadline = min(worker.started for worker in workers.values()) + time_limit
+                timeout = max(0, min(timeout, deadline - time.time()))
+            ready = wait(list(workers), timeout)
+            if not ready:
+                for worker in list(workers.values()):
+                    if time_limit and worker.chunk and time.time() - worker.started >= time_limit:
+                        yield abandon(worker, 'time')
+                    elif not worker.process.is_alive():
+                        yield abandon(worker, None)
+                continue
+
+            for connection in ready:
+                worker = workers[connection]
+                try:
+                    position, result = connection.recv()
+                except (EOFError, IOError, OSError):
+                    yield abandon(worker, None)
+                    continue
+
+                if position is None:
+                    if result:
+                        del workers[connection]
+                        worker.stop()
+                    elif pending:
+                        worker.assign(pending.popleft())
+                    else:
+                        del workers[connection]
+                        worker.stop()
+                elif result is None:
+                    yield abandon(worker, 'memory')
+                else:
+                    worker.chunk.pop(0)
+                    worker.started = time.time()
+                    yield [(position, result)]
+    finally:
+        for worker in list(workers.values()):
+            worker.stop(kill=True)
+
+
+def run(read, check, paths, reporter=modReporter.Default, settings_path=None, jobs=1, read_ahead=0, history=None,
+        threads=False, max_errors=None, time_limit=None, memory_limit=None, recycle_after=None, recycle_memory=None,
+        known=None, find_duplicates=None, **setting_overrides):
+    """Checks every path, using up to jobs processes (0 for one per CPU), returning the warning total.
+
+    With threads set, the jobs run as threads of this process instead, sharing its caches. This only pays off on
+    interpreters without a global interpreter lock.
+
+    Each path is loaded with read(path) and the outcome handed to check(path, source, reporter, settings_path,
+    **setting_overrides). Both must be importable at module level so that worker processes can find them. When
+    working in a single process, up to read_ahead files are read by background threads while earlier ones are being
+    checked. When using several processes, files are scheduled most expensive first, estimating their cost from
+    their size and the per-file timings kept in the history file, which is brought up to date afterwards. Results
+    are always reported in the order paths were given.
+
+    Once max_errors warnings have been found no more files are started and any queued work is abandoned. When working
+    in parallel, every file that had already been checked by then is still reported, so the total may overshoot.
+
+    A time_limit in seconds or memory_limit in megabytes puts every file on a budget, checking in worker processes
+    even when jobs is 1, see _supervise along with recycle_after and recycle_memory. Budgets can not be enforced on
+    threads, so they are ignored when threads is set.
+
+    known can supply results without checking at all: known.lookup(path) is asked for each path's Result before any
+    work is scheduled, returning None if it has to be checked, and known.record(result) is told about every file
+    checked, or spared as a duplicate. Both are only ever called from this process.
+
+    find_duplicates(paths) can spare checking files that would give the same results as another, returning
+    {index: index of the identical file} for those among the paths left to check. Their results are copied from the
+    identical file's, see Result.renamed.
+
+    """
+    if not jobs or jobs < 0:
+        jobs = multiprocessing.cpu_count()
+    supervised = bool(time_limit or memory_limit) and not threads
+    serial = jobs == 1 and not supervised
+
+    warnings = 0
+    if serial and not known and not find_duplicates:
+        if read_ahead:
+            sources = prefetch(read, paths, read_ahead)
+        else:
+            sources = ((path, read(path)) for path in paths)
+        for path, source in sources:
+            warnings += check(path, source, reporter, settings_path, **setting_overrides)
+            if max_errors and warnings >= max_errors:
+                break
+        return warnings
+
+    paths = list(paths)
+    history = History(None if serial else history)
+    finished = {}
+    if known:
+        for position, path in enumerate(paths):
+            result = known.lookup(path)
+            if result:
+                finished[position] = result
+    looked_up = set(finished)
+    positions = [position for position in range(len(paths)) if position not in finished]
+    copies = {}
+    if find_duplicates:
+        duplicates = find_duplicates([paths[position] for position in positions])
+        for index, original in sorted(itemsview(duplicates)):
+            copies.setdefault(positions[original], []).append(positions[index])
+        positions = [position for index, position in enumerate(positions) if index not in duplicates]
+    if serial and not known and not copies:
+        return run(read, check, paths, reporter, settings_path, jobs=1, read_ahead=read_ahead, max_errors=max_errors,
+                   **setting_overrides)
+
+    pool, sizes = None, {}
+    if serial or not positions:
+        batches = _check_serially(read, check, [(position, paths[position]) for position in positions], read_ahead,
+                                  settings_path, setting_overrides)
+    else:
+        chunks, chunk_sizes = _schedule([paths[position] for position in positions], jobs, history)
+        chunks = [[(positions[index], path) for index, path in chunk] for chunk in chunks]
+        sizes = dict(zip(positions, chunk_sizes))
+        if len(chunks) <= 1 and not supervised and not known and not copies:
+            return run(read, check, paths, reporter, settings_path, jobs=1, read_ahead=read_ahead,
+                       max_errors=max_errors, **setting_overrides)
+        if threads:
+            pool = multiprocessing.pool.ThreadPool(min(jobs, len(chunks)))
+            batches = pool.imap_unordered(_check_chunk, ((read, check, chunk, settings_path, setting_overrides)
+                                                         for chunk in chunks))
+        else:
+            batches = _supervise(read, check, chunks, min(jobs, len(chunks)), settings_path, setting_overrides,
+                                 time_limit, memory_limit, recycle_after, recycle_memory)
+    try:
+        # Checked files count towards max_errors as soon as they arrive, known ones only once reached in order
+        next_position, found = 0, 0
+        for results in itertools.chain([[]], batches):
+            for position, result in results:
+                finished[position] = result
+                found += result.warnings
+                if position in sizes:
+                    history.record(result.filename, sizes[position], result.duration)
+                if known:
+                    known.record(result)
+                for position in copies.get(position, ()):
+                    finished[position] = result.renamed(paths[position])
+                    found += result.warnings
+                    if known:
+                        known.record(finished[position])
+            while next_position in finished and not (max_errors and found >= max_errors):
+                result = finished.pop(next_position)
+                result.report(reporter)
+                warnings += result.warnings
+                if next_position in looked_up:
+                    found += result.warnings
+                next_position += 1
+            if max_errors and found >= max_errors:
+                for position in sorted(finished):
+                    if position not in looked_up:
+                        finished[position].report(reporter)
+                        warnings += finished[position].warnings
+                break
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+        else:
+            batches.close()
+    history.save()
+    return warnings
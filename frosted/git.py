@@ -0,0 +1,91 @@
+"""frosted/git.py.
+
+Defines how frosted reads what is staged for commit straight out of a git repository's index, without touching the
+working tree or writing anything to disk.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and
+to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import subprocess
+
+from pies.overrides import *
+
+__all__ = ['BlobReader', 'GitError', 'staged', 'toplevel']
+
+
+class GitError(Exception):
+    """Raised when git is missing or refuses to answer."""
+
+
+def _git(arguments, cwd):
+    try:
+        process = subprocess.Popen(['git'] + arguments, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as error:
+        raise GitError('unable to run git: {0}'.format(error))
+    stdout, stderr = process.communicate()
+    if process.returncode:
+        raise GitError(stderr.decode('utf-8', 'replace').strip() or 'git {0} failed'.format(arguments[0]))
+    return stdout
+
+
+def toplevel(path):
+    """Returns the root of the working tree of the git repository containing path."""
+    return _git(['rev-parse', '--show-toplevel'], path).decode('utf-8').rstrip('\n')
+
+
+def staged(repository):
+    """Returns the paths, relative to the root of repository, of every file added, copied, modified or renamed in its
+    index since the last commit."""
+    output = _git(['diff', '--cached', '--name-only', '--diff-filter=ACMR', '-z'], repository)
+    return [path for path in output.decode('utf-8').split('\0') if path]
+
+
+class BlobReader(object):
+    """Reads any number of objects through a single `git cat-file --batch` process."""
+
+    def __init__(self, repository):
+        try:
+            self.process = subprocess.Popen(['git', 'cat-file', '--batch'], cwd=repository, stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE)
+        except OSError as error:
+            raise GitError('unable to run git: {0}'.format(error))
+
+    def read(self, name):
+        """Returns the content of the object git knows as name, such as ':path' for a staged file, or None if it is
+        missing."""
+        if '\n' in name:
+            return None
+        self.process.stdin.write(name.encode('utf-8') + b'\n')
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().split()
+        if not header:
+            raise GitError('git cat-file stopped unexpectedly')
+        if header[-1] == b'missing':
+            return None
+        content = self.process.stdout.read(int(header[2]))
+        self.process.stdout.read(1)
+        return content
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.stdout.close()
+        self.process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
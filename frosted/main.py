@@ -5,19 +5,49 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import argparse
+import signal
 import sys
 
 from pies.overrides import *
 
-from frosted import __version__
-from frosted.api import check, check_path, check_recursive
+from frosted import __version__, cache, engine, git
+from frosted import reporter as modReporter
+from frosted.api import check, check_paths, check_recursive, check_staged, check_stream
 
 
-def main():
+def shard(value):
+    """Parses a K/N shard specification into an (index, count) pair."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected K/N, for example 1/4')
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError('K must be between 1 and N')
+    return index, count
+
+
+def merge(argv=None, reporter=modReporter.Default):
+    parser = argparse.ArgumentParser(prog='frosted merge',
+                                     description='Combine the --results files written by several frosted runs.')
+    parser.add_argument('results', nargs='+', help='The results files to combine into one report.')
+    warnings = 0
+    for results_path in parser.parse_args(argv).results:
+        with open(results_path) as results_file:
+            recorder, results_warnings = modReporter.load(results_file)
+        recorder.replay(reporter)
+        warnings += results_warnings
+
+    raise SystemExit(warnings > 0)
+
+
+def main(argv=None, reporter=modReporter.Default, stdin=None):
     warnings = 0
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['merge']:
+        return merge(argv[1:], reporter)
 
     parser = argparse.ArgumentParser(description='Quickly check the correctness of your Python scripts.')
-    parser.add_argument('files', nargs='+', help='One file or a list of Python source files to check the syntax of.')
+    parser.add_argument('files', nargs='*', help='One file or a list of Python source files to check the syntax of.')
     parser.add_argument('-r', '--recursive', dest='recursive', action='store_true',
                         help='Recursively look for Python files to check')
     parser.add_argument('-s', '--skip', help='Files that frosted should skip over.', dest='skip', action='append')
@@ -29,20 +59,124 @@ def main():
                         dest='not_ignore_frosted_errors', action='append')
     parser.add_argument('-vb', '--verbose', help='Explicitly separate each section of data when displaying errors.',
                         dest='verbose', action='store_true')
+    parser.add_argument('-j', '--jobs', help='Number of processes to check with when recursing (0 for one per CPU).',
+                        dest='jobs', type=int, default=1)
+    parser.add_argument('--threads', help='Run the jobs as threads of one process, for free-threaded Python builds.',
+                        dest='threads', action='store_true')
+    parser.add_argument('--no-dedupe', help='Check every copy of files that are identical, rather than only the first.',
+                        dest='dedupe', action='store_false')
+    parser.add_argument('--follow-symlinks', help='Follow symbolic links to directories when checking recursively, '
+                        'rather than skipping them.', dest='follow_symlinks', action='store_true')
+    parser.add_argument('--read-ahead', help='Number of files to read in the background while checking recursively.',
+                        dest='read_ahead', type=int, default=0)
+    parser.add_argument('--history', help='Where to remember how long each file took to check, so that parallel runs '
+                        'can start the slowest files first.', dest='history', default=engine.DEFAULT_HISTORY_PATH)
+    parser.add_argument('--no-history', help='Neither use nor update the check time history.', dest='history',
+                        action='store_const', const=None)
+    parser.add_argument('--cache-dir', help='Where to keep the results of earlier checks, so that unchanged files are '
+                        'not checked again.', dest='cache_dir', default=cache.DEFAULT_CACHE_DIR)
+    parser.add_argument('--no-cache', help='Neither use nor update the result cache.', dest='cache_dir',
+                        action='store_const', const=None)
+    parser.add_argument('--cache-read-only', help='Use the result cache without ever writing to it, for jobs that '
+                        'should not be trusted with a shared cache.', dest='cache_read_only', action='store_true')
+    parser.add_argument('--shard', help='Only check the files in shard K of N, to split work between machines.',
+                        dest='shard', type=shard, metavar='K/N')
+    parser.add_argument('--function-jobs', help='Number of processes to check the function bodies of a single file '
+                        'with (0 for one per CPU).', dest='function_jobs', type=int, metavar='N')
+    parser.add_argument('--fail-fast', help='Stop checking as soon as a file with a warning has been found.',
+                        dest='fail_fast', action='store_true')
+    parser.add_argument('--max-errors', help='Stop checking once this many warnings have been found.',
+                        dest='max_errors', type=int, metavar='N')
+    parser.add_argument('--time-limit', help='Abandon any file that takes longer than this many seconds to check.',
+                        dest='time_limit', type=float, metavar='SECONDS')
+    parser.add_argument('--memory-limit', help='Abandon any file that takes more than this many megabytes to check.',
+                        dest='memory_limit', type=int, metavar='MB')
+    parser.add_argument('--recycle-after', help='Replace each worker process after it has checked this many files.',
+                        dest='recycle_after', type=int, metavar='N')
+    parser.add_argument('--recycle-memory', help='Replace each worker process once it has used this many megabytes.',
+                        dest='recycle_memory', type=int, metavar='MB')
+    parser.add_argument('--staged', help='Check the Python files staged for commit, as they are in the git index.',
+                        dest='staged', action='store_true')
+    parser.add_argument('--stream', help='Check buffers framed as "<length> <filename>" lines followed by their source '
+                        'from stdin until it closes, ending the output for each with a NUL line.', dest='stream',
+                        action='store_true')
+    parser.add_argument('--results', help='Also write the results as JSON to this file, for use with frosted merge.',
+                        dest='results')
+    parser.add_argument('--daemon', help='Stay running, checking the files frosted-client sends over a Unix socket.',
+                        dest='daemon', action='store_true')
+    parser.add_argument('--socket', help='The Unix socket the daemon listens on.', dest='socket')
     parser.add_argument('-v', '--version', action='version', version='frosted {0}'.format(__version__))
-    arguments = dict((key, value) for (key, value) in itemsview(vars(parser.parse_args())) if value)
+    arguments = vars(parser.parse_args(argv))
+    jobs = arguments.pop('jobs')
+    read_ahead = arguments.pop('read_ahead')
+    threads = arguments.pop('threads')
+    dedupe = arguments.pop('dedupe')
+    follow_symlinks = arguments.pop('follow_symlinks')
+    socket_path = arguments.pop('socket')
+    shard_spec = arguments.pop('shard')
+    history = arguments.pop('history')
+    results_path = arguments.pop('results')
+    budgets = dict((key, arguments.pop(key)) for key in ('time_limit', 'memory_limit', 'recycle_after',
+                                                          'recycle_memory'))
+    max_errors = arguments.pop('max_errors')
+    if arguments.pop('fail_fast'):
+        max_errors = 1
+    function_jobs = arguments.pop('function_jobs')
+    cache_dir = arguments.pop('cache_dir')
+    cache_read_only = arguments.pop('cache_read_only')
+    arguments = dict((key, value) for (key, value) in itemsview(arguments) if value)
+    if function_jobs is not None:
+        arguments['function_jobs'] = function_jobs
+    if arguments.pop('daemon', False):
+        from frosted import daemon
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        daemon.serve(socket_path)
+        raise SystemExit(0)
+    if cache_dir:
+        arguments['cache'] = cache.ResultCache(cache_dir, read_only=cache_read_only)
+        arguments['cache'].prune(every=cache.PRUNE_INTERVAL)
+
     file_names = arguments.pop('files', [])
+    if arguments.pop('stream', False):
+        stdin = stdin or sys.stdin
+        warnings = check_stream(getattr(stdin, 'buffer', stdin), getattr(reporter, 'stdout', sys.stdout), **arguments)
+        raise SystemExit(warnings > 0)
+    if arguments.pop('staged', False):
+        try:
+            warnings = check_staged(reporter, max_errors=max_errors, **arguments)
+        except git.GitError as error:
+            raise SystemExit('frosted: {0}'.format(error))
+        raise SystemExit(warnings > 0)
+    if not file_names:
+        parser.error('at least one file or - is required')
+    stderr = getattr(reporter, 'stderr', sys.stderr)
+    if results_path:
+        recorder = modReporter.Recorder()
+        reporter = modReporter.Tee((reporter, recorder))
+    index = cache.StatIndex(cache.DEFAULT_INDEX_PATH) if cache_dir and not cache_read_only else None
     if file_names == ['-']:
-        check(sys.stdin.read(), '<stdin>', **arguments)
+        check((stdin or sys.stdin).read(), '<stdin>', reporter, **arguments)
     elif arguments.get('recursive'):
-        warnings = check_recursive(file_names, **arguments)
+        arguments.update(budgets)
+        stats = {}
+        warnings = check_recursive(file_names, reporter, jobs=jobs, read_ahead=read_ahead, shard=shard_spec,
+                                   history=history, threads=threads, max_errors=max_errors, index=index, dedupe=dedupe,
+                                   stats=stats, follow_symlinks=follow_symlinks, **arguments)
+        if arguments.get('verbose') and stats['duplicates']:
+            stderr.write('frosted: {0} identical files were not checked again\n'.format(stats['duplicates']))
     else:
-        warnings = 0
-        for file_path in file_names:
-            try:
-                warnings += check_path(file_path, directly_being_checked=len(file_names), **arguments)
-            except IOError as e:
-                print("WARNING: Unable to parse file {0} due to {1}".format(file_name, e))
+        directly_being_checked = len(file_names)
+        if shard_spec:
+            file_names = engine.shard(file_names, *shard_spec)
+        arguments.update(budgets)
+        warnings = check_paths(file_names, reporter, max_errors=max_errors, index=index,
+                               directly_being_checked=directly_being_checked, **arguments)
+    if index:
+        index.close()
+
+    if results_path:
+        with open(results_path, 'w') as results_file:
+            modReporter.save(recorder, warnings, results_file)
 
     raise SystemExit(warnings > 0)
 
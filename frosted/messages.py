@@ -38,6 +38,9 @@ class MessageType(AbstractMessageType):
         def __str__(self):
             return self.message
 
+        def __reduce__(self):
+            return (_message, tuple(self))
+
     def __new__(cls, error_code, name, template, keyword='{0!s}'):
         global _ERROR_INDEX
         new_instance = AbstractMessageType.__new__(cls, error_code, name, template,
@@ -62,6 +65,17 @@ class MessageType(AbstractMessageType):
         return self.Message('{0}:{1}: {2}'.format(filename, values['lineno'], message),
                             self, values['lineno'], values['col'])
 
+    def __reduce__(self):
+        return (_message_type, (self.error_code, self.name, self.template, self.keyword))
+
+
+def _message_type(error_code, name, template, keyword):
+    """Returns the registered message type for error_code, so message types survive being pickled."""
+    return BY_CODE.get(error_code) or MessageType(error_code, name, template, keyword)
+
+
+def _message(message, message_type, lineno, col):
+    return MessageType.Message(message, message_type, lineno, col)
 
 
 class OffsetMessageType(MessageType):
@@ -113,4 +127,6 @@ ReturnWithArgsInsideGenerator = MessageType('E208', 'ReturnWithArgsInsideGenerat
                                             "'return' with argument inside generator", 'return')
 BareExcept = MessageType('W101', 'BareExcept', "bare except used: this is dangerous and should be avoided", 'except')
 FileSkipped = MessageType('W201', 'FileSkipped', "Skipped because of the current configuration", 'skipped')
+OverBudget = MessageType('W202', 'OverBudget', "Abandoned after going over the {0!s} budget for a single file",
+                         'budget')
 PythonSyntaxError = SyntaxErrorType('E402', 'PythonSyntaxError', "{0!s}", "")
@@ -0,0 +1,111 @@
+"""frosted/plugins.py.
+
+Defines the process wide registry of frosted plugins: checkers installed by other distributions under the
+'frosted.plugins' entry point group, each with a check(filename) method returning (message, loc, args, kwargs) tuples.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and
+to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import threading
+
+from pies.overrides import *
+
+try:
+    from importlib import metadata as importlib_metadata
+except ImportError:
+    try:
+        import importlib_metadata
+    except ImportError:
+        importlib_metadata = None
+
+__all__ = ['GROUP', 'Registry', 'registry', 'refresh']
+
+GROUP = 'frosted.plugins'
+
+
+def _entry_points():
+    """Returns every entry point in GROUP, using importlib.metadata where available as it is far cheaper to import
+    than pkg_resources."""
+    if importlib_metadata is None:
+        import pkg_resources
+        return list(pkg_resources.iter_entry_points(group=GROUP))
+
+    entry_points = importlib_metadata.entry_points()
+    if hasattr(entry_points, 'select'):
+        return list(entry_points.select(group=GROUP))
+    return list(entry_points.get(GROUP, ()))
+
+
+def _describe(entry_point):
+    target = getattr(entry_point, 'value', None) or entry_point.module_name
+    version = getattr(getattr(entry_point, 'dist', None), 'version', None)
+    return '{0}={1} {2}'.format(entry_point.name, target, version or '')
+
+
+class Registry(object):
+    """Finds the installed plugins the first time they are asked about, and loads each one the first time it is used.
+
+    Everything found is kept until refresh is called, so that every Checker in the process shares one scan of the
+    installed distributions.
+
+    """
+
+    def __init__(self, entry_points=_entry_points):
+        self._find_entry_points = entry_points
+        self._lock = threading.Lock()
+        self._entry_points = None
+        self._loaded = {}
+
+    def entry_points(self):
+        """Returns the entry point of every installed plugin, keyed by name."""
+        with self._lock:
+            if self._entry_points is None:
+                self._entry_points = dict((entry_point.name, entry_point)
+                                          for entry_point in self._find_entry_points())
+            return self._entry_points
+
+    def describe(self):
+        """Returns a sorted description of every installed plugin and the version providing it."""
+        return sorted(_describe(entry_point) for entry_point in self.entry_points().values())
+
+    def enabled(self, settings):
+        """Returns the names of the plugins to run given settings: those listed in enabled_plugins, or all of them if
+        it is empty, less any listed in disabled_plugins."""
+        names = set(self.entry_points())
+        if settings.get('enabled_plugins'):
+            names.intersection_update(settings['enabled_plugins'])
+        return sorted(names.difference(settings.get('disabled_plugins') or ()))
+
+    def load(self, name):
+        """Returns the plugin called name, loading it if this is the first time it has been asked for."""
+        plugin = self._loaded.get(name)
+        if plugin is None:
+            plugin = self._loaded[name] = self.entry_points()[name].load()
+        return plugin
+
+    def refresh(self):
+        """Forgets every plugin found or loaded, so that plugins installed or removed since are noticed."""
+        with self._lock:
+            self._entry_points = None
+            self._loaded = {}
+
+
+registry = Registry()
+
+
+def refresh():
+    """Has the process wide registry look for installed plugins again."""
+    registry.refresh()
@@ -0,0 +1,134 @@
+"""frosted/pytest_plugin.py.
+
+Defines a pytest plugin that checks each collected Python file with frosted when pytest is run with --frosted,
+remembering the files found clean so that they are not checked again until they change.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and
+to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import hashlib
+import os
+from io import StringIO
+
+import pytest
+from pies.overrides import *
+
+from frosted import api, cache
+from frosted.reporter import Reporter
+
+__all__ = ['CACHE_KEY', 'FrostedError', 'FrostedFile', 'FrostedItem', 'FrostedPlugin']
+
+CACHE_KEY = 'frosted/clean'  # where the files found clean are remembered within pytest's cache
+PROPERTY = 'frosted'  # the user property carrying a clean result from a worker back to the controlling process
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('frosted')
+    group.addoption('--frosted', action='store_true', dest='frosted',
+                    help='Check each Python file with frosted, skipping those found clean since they last changed.')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'frosted: checks a file with frosted')
+    if config.getoption('frosted'):
+        config.pluginmanager.register(FrostedPlugin(config), 'frosted-checks')
+
+
+class FrostedError(Exception):
+    """Raised when frosted finds something wrong with a file."""
+
+
+class FrostedPlugin(object):
+    """Collects a FrostedItem for each Python file, and keeps the record of which files were found clean.
+
+    Under pytest-xdist the items are shared out between the workers like any others. Each worker only reads the
+    record, sending what it finds clean back to the controlling process on its reports, which alone writes the record
+    once the session is over.
+
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.clean = config.cache.get(CACHE_KEY, {}) if getattr(config, 'cache', None) else {}
+        self.found = {}
+
+    if getattr(pytest, 'version_tuple', (0, )) >= (7, ):
+        def pytest_collect_file(self, file_path, parent):
+            if file_path.suffix == '.py':
+                return FrostedFile.from_parent(parent, path=file_path)
+    else:
+        def pytest_collect_file(self, path, parent):
+            if path.ext == '.py':
+                return FrostedFile.from_parent(parent, fspath=path)
+
+    def pytest_runtest_logreport(self, report):
+        if report.when == 'call':
+            for (name, value) in report.user_properties:
+                if name == PROPERTY:
+                    self.found[value[0]] = value[1:]
+
+    def pytest_sessionfinish(self, session):
+        if self.found and not hasattr(self.config, 'workerinput') and getattr(self.config, 'cache', None):
+            self.clean.update(self.found)
+            self.config.cache.set(CACHE_KEY, self.clean)
+
+
+class FrostedFile(pytest.File):
+
+    def collect(self):
+        yield FrostedItem.from_parent(self, name='FROSTED')
+
+
+class FrostedItem(pytest.Item):
+    """Checks a single file with frosted.api.check.
+
+    A file is skipped if it was found clean with the same settings and neither its modification time nor, failing
+    that, the hash of its content have changed since.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(FrostedItem, self).__init__(*args, **kwargs)
+        self.add_marker('frosted')
+
+    def runtest(self):
+        filename = str(self.fspath)
+        clean = self.config.pluginmanager.get_plugin('frosted-checks').clean.get(filename)
+        modified = os.stat(filename).st_mtime
+        signature = cache.signature(filename, api._effective_settings(filename, None, {}))
+        if clean and clean[:2] == [modified, signature]:
+            pytest.skip('unchanged since frosted found it clean')
+
+        source, error = api._read_source(filename)
+        if error:
+            raise FrostedError('{0}: {1}'.format(filename, error))
+        digest = hashlib.sha256(source.encode('utf-8')).hexdigest()
+        if clean and clean[1:] == [signature, digest]:
+            self.user_properties.append((PROPERTY, [filename, modified, signature, digest]))
+            pytest.skip('unchanged since frosted found it clean')
+
+        output = StringIO()
+        if api.check(source, filename, Reporter(output, output)):
+            raise FrostedError(output.getvalue())
+        self.user_properties.append((PROPERTY, [filename, modified, signature, digest]))
+
+    def repr_failure(self, excinfo):
+        if excinfo.errisinstance(FrostedError):
+            return excinfo.value.args[0]
+        return super(FrostedItem, self).repr_failure(excinfo)
+
+    def reportinfo(self):
+        return (self.fspath, None, 'frosted-check')
@@ -18,11 +18,14 @@ CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFT
 """
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import json
 import sys
 from collections import namedtuple
 
 from pies.overrides import *
 
+from frosted import messages as modMessages
+
 
 class Reporter(namedtuple('Reporter', ('stdout', 'stderr'))):
     """Formats the results of frosted checks and then presents them to the user."""
@@ -36,4 +39,60 @@ class Reporter(namedtuple('Reporter', ('stdout', 'stderr'))):
         self.stdout.write(str(message))
         self.stdout.write('\n')
 
+
+class Recorder(namedtuple('Recorder', ('messages', 'errors'))):
+    """Collects the results of frosted checks so they can be presented later, possibly from another process."""
+
+    def __new__(cls, messages=None, errors=None):
+        return super(Recorder, cls).__new__(cls, messages or [], errors or [])
+
+    def unexpected_error(self, filename, msg):
+        """Record an unexpected_error specific to the provided filename."""
+        self.errors.append((filename, msg))
+
+    def flake(self, message):
+        """Record an error message."""
+        self.messages.append(message)
+
+    def replay(self, reporter):
+        """Present everything recorded so far using the given reporter."""
+        for filename, msg in self.errors:
+            reporter.unexpected_error(filename, msg)
+        for message in self.messages:
+            reporter.flake(message)
+
+
+class Tee(namedtuple('Tee', ('reporters', ))):
+    """Presents the results of frosted checks using several reporters at once."""
+
+    def unexpected_error(self, filename, msg):
+        for reporter in self.reporters:
+            reporter.unexpected_error(filename, msg)
+
+    def flake(self, message):
+        for reporter in self.reporters:
+            reporter.flake(message)
+
+
+def dumps(recorder, warnings):
+    """Returns recorded results and their warning total as JSON text, so they can be merged later."""
+    text = json.dumps({'warnings': warnings,
+                       'errors': recorder.errors,
+                       'messages': [{'message': message.message, 'type': list(message.type[:4]),
+                                     'lineno': message.lineno, 'col': message.col} for message in recorder.messages]})
+    return text.decode('utf-8') if isinstance(text, bytes) else text
+
+
+def save(recorder, warnings, stream):
+    """Writes recorded results and their warning total to stream as JSON, see dumps."""
+    stream.write(dumps(recorder, warnings))
+
+
+def load(stream):
+    """Reads results written by save, returning a (Recorder, warnings) pair."""
+    data = json.load(stream)
+    messages = [modMessages._message(message['message'], modMessages._message_type(*message['type']),
+                                     message['lineno'], message['col']) for message in data['messages']]
+    return Recorder(messages, [tuple(error) for error in data['errors']]), data['warnings']
+
 Default = Reporter(sys.stdout, sys.stderr)
@@ -25,6 +25,7 @@ OTHER DEALINGS IN THE SOFTWARE.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import os
+import time
 
 from pies.functools import lru_cache
 from pies.overrides import *
@@ -35,39 +36,138 @@ except ImportError:
     import ConfigParser as configparser
 
 MAX_CONFIG_SEARCH_DEPTH = 25 # The number of parent directories frosted will look for a config file within
+REVALIDATE_SECONDS = 2  # How often cached settings are checked against the config files they came from
 
 # Note that none of these lists must be complete as they are simply fallbacks for when included auto-detection fails.
 default = {'skip': [],
            'ignore_frosted_errors': ['W201'],
            'ignore_frosted_errors_for__init__.py': ['E101', 'E103'],
            'verbose': False,
-           'run_doctests': False}
+           'run_doctests': False,
+           'function_jobs': 1,
+           'enabled_plugins': [],
+           'disabled_plugins': []}
+
+# The config files settings are read from, in order: (name, fallback in the home directory, sections to read)
+CONFIG_FILES = (('.editorconfig', '~/.editorconfig', ('*', '*.py', '**.py')),
+                ('.frosted.cfg', '~/.frosted.cfg', ('settings', )),
+                ('setup.cfg', None, ('frosted', )))
+
+_consulted = {}  # The (stat signature, or None if missing, when it was taken) of every config file consulted
+_revalidated = {}  # When the config files the settings for each directory depend on were last checked
 
 
-@lru_cache()
 def from_path(path):
-    computed_settings = default.copy()
-    _update_settings_with_config(path, '.editorconfig', '~/.editorconfig', ('*', '*.py', '**.py'), computed_settings)
-    _update_settings_with_config(path, '.frosted.cfg', '~/.frosted.cfg', ('settings', ), computed_settings)
-    _update_settings_with_config(path, 'setup.cfg', None, ('frosted', ), computed_settings)
-    return computed_settings
+    """Returns the settings that apply to path, as a new dictionary that the caller is free to change.
+
+    Settings are cached, but the config files those for path were built from, and those looked for nearer to path
+    and found missing, are checked for changes so that long running processes notice them. Each file is checked at
+    most every REVALIDATE_SECONDS, and only when the settings of a directory depending on it are asked for.
+
+    """
+    _revalidate(path)
+    return _copy(_from_config_files(_config_files(path)))
 
 
-def _update_settings_with_config(path, name, default, sections, computed_settings):
-    editor_config_file = default and os.path.expanduser(default)
-    tries = 0
-    current_directory = path
-    while current_directory and tries < MAX_CONFIG_SEARCH_DEPTH:
-        potential_path = os.path.join(current_directory, native_str(name))
-        if os.path.exists(potential_path):
-            editor_config_file = potential_path
-            break
+def invalidate():
+    """Forgets all cached settings, so that every config file is looked for and read again."""
+    _consulted.clear()
+    _revalidated.clear()
+    for cached in (_nearest_config_files, _home_config_file, _dependencies, _from_config_files, _get_config_data):
+        cached.cache_clear()
 
-        current_directory = os.path.split(current_directory)[0]
-        tries += 1
 
-    if editor_config_file and os.path.exists(editor_config_file):
-        _update_with_config_file(computed_settings, editor_config_file, sections)
+def _stat_signature(path):
+    try:
+        status = os.stat(path)
+    except OSError:
+        return None
+    return (status.st_mtime, status.st_size, status.st_ino)
+
+
+def _consult(path):
+    """Returns whether the config file at path exists, remembering enough about it to tell when it has changed."""
+    signature = _stat_signature(path)
+    _consulted[path] = (signature, time.time())
+    return signature is not None
+
+
+def _revalidate(directory):
+    """Forgets all cached settings if any config file the settings for directory depend on has changed."""
+    now = time.time()
+    if now - _revalidated.get(directory, 0) < REVALIDATE_SECONDS:
+        return
+    _revalidated[directory] = now
+    for path in _dependencies(directory):
+        signature, consulted = _consulted.get(path, (None, now))
+        if now - consulted >= REVALIDATE_SECONDS:
+            if _stat_signature(path) != signature:
+                invalidate()
+                return
+            _consulted[path] = (signature, now)
+
+
+def _copy(settings):
+    return dict((key, list(value) if isinstance(value, list) else value) for key, value in itemsview(settings))
+
+
+def _config_files(path):
+    """Returns the file each of CONFIG_FILES should be read from for path, or None where there is none."""
+    return tuple(nearest if nearest and distance < MAX_CONFIG_SEARCH_DEPTH else _home_config_file(home)
+                 for (nearest, distance), (name, home, sections) in zip(_nearest_config_files(path), CONFIG_FILES))
+
+
+@lru_cache(maxsize=None)
+def _nearest_config_files(directory):
+    """Returns a (path, distance) pair for each of CONFIG_FILES, locating the nearest one within directory or its
+    parents and how many levels up it is.
+
+    Each directory is only ever probed once, with missing files remembered as well, as everything beyond directory
+    itself comes from the answer already worked out for its parent.
+
+    """
+    parent = os.path.split(directory)[0]
+    if parent and parent != directory:
+        inherited = _nearest_config_files(parent)
+    else:
+        inherited = ((None, 0), ) * len(CONFIG_FILES)
+
+    nearest = []
+    for (name, home, sections), (path, distance) in zip(CONFIG_FILES, inherited):
+        potential_path = os.path.join(directory, native_str(name))
+        nearest.append((potential_path, 0) if _consult(potential_path) else (path, distance + 1))
+    return tuple(nearest)
+
+
+@lru_cache(maxsize=None)
+def _home_config_file(home):
+    config_file = home and os.path.expanduser(home)
+    return config_file if config_file and _consult(config_file) else None
+
+
+@lru_cache(maxsize=None)
+def _dependencies(directory):
+    """Returns the config files the settings for directory come from, along with every one that was looked for
+    nearer to it, or in the home directory, and found missing."""
+    dependencies = set(config_file for config_file in _config_files(directory) if config_file)
+    for (name, home, sections), (nearest, distance) in zip(CONFIG_FILES, _nearest_config_files(directory)):
+        current = directory
+        for level in range(min(distance, MAX_CONFIG_SEARCH_DEPTH)):
+            dependencies.add(os.path.join(current, native_str(name)))
+            current = os.path.split(current)[0]
+        if home and (not nearest or distance >= MAX_CONFIG_SEARCH_DEPTH):
+            dependencies.add(os.path.expanduser(home))
+    return tuple(dependencies)
+
+
+@lru_cache(maxsize=None)
+def _from_config_files(config_files):
+    """Returns the settings built from config_files, shared by every directory those same files apply to."""
+    computed_settings = _copy(default)
+    for config_file, (name, home, sections) in zip(config_files, CONFIG_FILES):
+        if config_file:
+            _update_with_config_file(computed_settings, config_file, sections)
+    return computed_settings
 
 
 def _update_with_config_file(computed_settings, file_path, sections):
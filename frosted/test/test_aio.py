@@ -0,0 +1,59 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import pytest
+from pies.overrides import *
+
+from frosted.messages import UnusedImport
+
+from .utils import Node
+
+pytestmark = pytest.mark.skipif("sys.version_info < (3, 6)")
+
+
+def run(coroutine):
+    import asyncio
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def collect(generator):
+    """Drives an asynchronous generator to completion, returning everything it yielded."""
+    import asyncio
+    loop = asyncio.new_event_loop()
+    results = []
+    try:
+        while True:
+            results.append(loop.run_until_complete(generator.__anext__()))
+    except StopAsyncIteration:
+        return results
+    finally:
+        loop.close()
+
+
+def test_acheck():
+    """acheck returns the messages for a buffer instead of reporting them."""
+    from frosted.api import acheck
+    result = run(acheck('import contraband\n', 'buffer.py'))
+    assert result.filename == 'buffer.py'
+    assert result.warnings == 1
+    assert [str(message) for message in result.messages] == [str(UnusedImport('buffer.py', Node(1), 'contraband'))]
+    assert result.errors == []
+
+
+def test_acheck_paths(tmpdir):
+    """acheck_paths yields one result per file, however little concurrency it is allowed."""
+    from frosted.api import acheck_paths
+    paths = []
+    for index in range(5):
+        module = tmpdir.join('module{0}.py'.format(index))
+        module.write('import os\n' * index)
+        paths.append(str(module))
+    paths.append(str(tmpdir.join('missing.py')))
+
+    results = dict((result.filename, result) for result in collect(acheck_paths(paths, concurrency=2)))
+    assert sorted(results) == sorted(paths)
+    assert [results[path].warnings for path in paths] == [0, 1, 2, 3, 4, 1]
+    assert results[paths[-1]].errors == [(paths[-1], 'No such file or directory')]
@@ -20,16 +20,21 @@ OTHER DEALINGS IN THE SOFTWARE.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import os
+import pickle
+import subprocess
 import sys
 import tempfile
+import time
 from io import StringIO
 
 import pytest
 from pies.overrides import *
 
-from frosted.api import check_path, check_recursive
-from frosted.messages import PythonSyntaxError, UnusedImport
-from frosted.reporter import Reporter
+from frosted import api, checker, engine, settings
+from frosted.api import check, check_path, check_paths, check_recursive, check_staged
+from frosted.messages import Message, OverBudget, PythonSyntaxError, UnusedImport
+from frosted.cache import STALE_SECONDS, TREE_BYTES_PER_CHARACTER, ParseCache, ResultCache, StatIndex, signature
+from frosted.reporter import Recorder, Reporter, dumps
 
 from .utils import LoggingReporter, Node
 
@@ -105,6 +110,23 @@ def make_temp_file(content):
     return fpath
 
 
+def make_modules(count, source="import os{0}\n"):
+    """Make a temporary directory of count modules named module0.py onwards, formatting source with each number."""
+    directory = tempfile.mkdtemp()
+    for index in range(count):
+        with open(os.path.join(directory, 'module{0}.py'.format(index)), 'w') as module:
+            module.write(source.format(index))
+    return directory
+
+
+def assert_same_as_serial(directory, warnings, **options):
+    """Assert that checking directory with options reports warnings, exactly as a serial run does and in its order."""
+    serial_log, log = [], []
+    assert check_recursive([directory], LoggingReporter(serial_log)) == warnings
+    assert check_recursive([directory], LoggingReporter(log), **options) == warnings
+    assert log == serial_log
+
+
 def assert_contains_output(path, flakeList):
     """Assert that provided causes at minimal the errors provided in the error list."""
     out = StringIO()
@@ -300,3 +322,523 @@ def test_check_recursive():
     assert warnings == 2
     assert sorted(log) == sorted([('flake', str(UnusedImport(file1, Node(1), 'baz'))),
                                   ('flake', str(UnusedImport(file2, Node(1), 'contraband')))])
+
+
+def test_check_recursive_jobs(monkeypatch):
+    """check_recursive gives the same results, in the same order, when spreading work across processes."""
+    monkeypatch.setattr(engine, 'MAX_CHUNK_FILES', 1)
+    assert_same_as_serial(make_modules(4), 4, jobs=2)
+
+
+def test_messages_survive_pickling():
+    """Messages can be sent between processes, keeping their registered message type."""
+    message = UnusedImport('foo.py', Node(1), 'os')
+    unpickled = pickle.loads(pickle.dumps(message))
+    assert unpickled == message
+    assert unpickled.type is UnusedImport
+    assert str(unpickled) == str(message)
+
+
+def test_check_recursive_read_ahead():
+    """Reading files ahead of the checker does not change what is reported, or in which order."""
+    assert_same_as_serial(make_modules(6), 6, read_ahead=2)
+
+
+def test_prefetch_keeps_order_and_errors():
+    """prefetch yields results in order and raises errors where they occur."""
+    assert list(engine.prefetch(lambda item: item * 2, range(10), 3)) == [(item, item * 2) for item in range(10)]
+    results = engine.prefetch(lambda item: 1 // item, [1, 0], 2)
+    assert next(results) == (1, 1)
+    with pytest.raises(ZeroDivisionError):
+        next(results)
+
+
+def test_schedule_starts_expensive_files_first(monkeypatch):
+    """The most expensive files are dispatched first and on their own, while cheap files share chunks."""
+    sizes = {'big.py': 10000, 'medium.py': 5000, 'a.py': 10, 'b.py': 10, 'c.py': 10}
+    monkeypatch.setattr(engine, '_file_size', sizes.__getitem__)
+    paths = ['a.py', 'b.py', 'big.py', 'medium.py', 'c.py']
+
+    chunks, chunk_sizes = engine._schedule(paths, 2, engine.History())
+    assert [[path for position, path in chunk] for chunk in chunks] == [['big.py'], ['medium.py'], ['a.py', 'b.py',
+                                                                                                    'c.py']]
+    assert chunks[0] == [(2, 'big.py')]
+    assert chunk_sizes == [10, 10, 10000, 5000, 10]
+
+    history = engine.History()
+    history.record('c.py', 10, 1.0)
+    chunks, chunk_sizes = engine._schedule(paths, 2, history)
+    assert [[path for position, path in chunk] for chunk in chunks] == [['c.py'], ['big.py', 'medium.py', 'a.py',
+                                                                                   'b.py']]
+
+
+def test_check_recursive_updates_history(monkeypatch):
+    """Parallel runs record how long each file took and use it to estimate costs next time."""
+    monkeypatch.setattr(engine, 'MAX_CHUNK_FILES', 1)
+    tempdir = make_modules(3)
+    paths = [os.path.join(tempdir, name) for name in sorted(os.listdir(tempdir))]
+    history_path = os.path.join(tempdir, 'cache', 'history.json')
+    assert_same_as_serial(tempdir, 3, jobs=2, history=history_path)
+
+    history = engine.History(history_path)
+    assert sorted(history.files) == sorted(paths)
+    assert history.estimate(paths[0], os.path.getsize(paths[0])) == history.files[paths[0]][1]
+
+
+def test_history_forgets_old_files(monkeypatch):
+    """Files not checked for MAX_HISTORY_AGE, and the least recently checked beyond MAX_HISTORY_FILES, are dropped."""
+    monkeypatch.setattr(engine, 'MAX_HISTORY_FILES', 2)
+    path = os.path.join(tempfile.mkdtemp(), 'history.json')
+    with open(path, 'w') as history_file:
+        history_file.write('{"files": {"/legacy.py": [10, 1.0]}}')
+    history = engine.History(path)
+    now = time.time()
+    for (name, checked) in (('old.py', now - engine.MAX_HISTORY_AGE - 1), ('a.py', now - 3), ('b.py', now - 2)):
+        history.files[os.path.abspath(name)] = (10, 1.0, checked)
+    history.save()
+    assert sorted(engine.History(path).files) == sorted(['/legacy.py', os.path.abspath('b.py')])
+
+
+def test_check_recursive_threads(monkeypatch):
+    """Checking with a pool of threads reports exactly what a serial run does."""
+    monkeypatch.setattr(engine, 'MAX_CHUNK_FILES', 1)
+    tempdir = make_modules(8, "import os{0}\ndef function():\n    return undefined{0}\n")
+    assert_same_as_serial(tempdir, 16, jobs=4, threads=True)
+
+
+def test_file_specific_ignores_do_not_leak():
+    """Ignoring errors for one file leaves the shared settings untouched for every other file."""
+    tempdir = tempfile.mkdtemp()
+    for name in ('first.py', 'second.py'):
+        with open(os.path.join(tempdir, name), 'w') as module:
+            module.write("import os\n")
+    overrides = {'ignore_frosted_errors_for_first.py': ['E101']}
+    assert check_path(os.path.join(tempdir, 'first.py'), Reporter(StringIO(), StringIO()), **overrides) == 0
+    assert check_path(os.path.join(tempdir, 'second.py'), Reporter(StringIO(), StringIO()), **overrides) == 1
+    assert check_path(os.path.join(tempdir, 'second.py'), Reporter(StringIO(), StringIO())) == 1
+
+
+def test_settings_probe_each_directory_once(monkeypatch):
+    """Sibling directories share the config file lookups of their parents, missing files included."""
+    root = tempfile.mkdtemp()
+    with open(os.path.join(root, '.frosted.cfg'), 'w') as config:
+        config.write('[settings]\nignore_frosted_errors=E303\n')
+    leaves = [os.path.join(root, 'package', 'module{0}'.format(index)) for index in range(10)]
+    probed = []
+    stat = os.stat
+
+    def counting_stat(path, *args, **kwargs):
+        if path.startswith(root):
+            probed.append(os.path.dirname(path))
+        return stat(path, *args, **kwargs)
+    monkeypatch.setattr(os, 'stat', counting_stat)
+    monkeypatch.setattr(settings, 'REVALIDATE_SECONDS', 60)
+    for leaf in leaves:
+        assert 'E303' in settings.from_path(leaf)['ignore_frosted_errors']
+    assert sorted(probed) == sorted(([root, os.path.join(root, 'package')] + leaves) * len(settings.CONFIG_FILES))
+
+
+def test_settings_revalidate_only_what_they_depend_on(monkeypatch):
+    """Checking cached settings for changes only looks at the config files the directory asked about depends on."""
+    root = tempfile.mkdtemp()
+    with open(os.path.join(root, '.frosted.cfg'), 'w') as config:
+        config.write('[settings]\nignore_frosted_errors=E303\n')
+    leaves = [os.path.join(root, 'package', 'module{0}'.format(index)) for index in range(10)]
+    for leaf in leaves:
+        settings.from_path(leaf)
+    probed = []
+    stat = os.stat
+
+    def counting_stat(path, *args, **kwargs):
+        if path.startswith(root):
+            probed.append(os.path.dirname(path))
+        return stat(path, *args, **kwargs)
+    monkeypatch.setattr(os, 'stat', counting_stat)
+    monkeypatch.setattr(settings, 'REVALIDATE_SECONDS', 0)
+    assert 'E303' in settings.from_path(leaves[0])['ignore_frosted_errors']
+    assert sorted(set(probed)) == sorted([root, os.path.join(root, 'package'), leaves[0]])
+    assert len(probed) == 3 * len(settings.CONFIG_FILES)
+
+
+def test_settings_notice_config_changes(monkeypatch):
+    """Cached settings are rebuilt once a config file they came from changes, or one that was missing appears."""
+    monkeypatch.setattr(settings, 'REVALIDATE_SECONDS', 0)
+    root = tempfile.mkdtemp()
+    package = os.path.join(root, 'package')
+    os.mkdir(package)
+    with open(os.path.join(root, '.frosted.cfg'), 'w') as config:
+        config.write('[settings]\nignore_frosted_errors=E303\n')
+    assert 'E303' in settings.from_path(package)['ignore_frosted_errors']
+
+    with open(os.path.join(root, '.frosted.cfg'), 'w') as config:
+        config.write('[settings]\nignore_frosted_errors=E101,E303\n')
+    assert 'E101' in settings.from_path(package)['ignore_frosted_errors']
+
+    with open(os.path.join(package, 'setup.cfg'), 'w') as config:
+        config.write('[frosted]\nverbose=true\n')
+    assert settings.from_path(package)['verbose']
+    monkeypatch.setattr(settings, 'REVALIDATE_SECONDS', 60)
+    os.remove(os.path.join(package, 'setup.cfg'))
+    assert settings.from_path(package)['verbose']
+    settings.invalidate()
+    assert not settings.from_path(package)['verbose']
+
+
+@pytest.mark.parametrize('jobs', (1, 2))
+def test_check_recursive_fail_fast(monkeypatch, jobs):
+    """fail_fast and max_errors stop checking once enough warnings have been found."""
+    monkeypatch.setattr(engine, 'MAX_CHUNK_FILES', 1)
+    tempdir = make_modules(20)
+    log = []
+    warnings = check_recursive([tempdir], LoggingReporter(log), jobs=jobs, fail_fast=True)
+    assert 1 <= warnings < 20
+    assert len(log) == warnings
+    if jobs == 1:
+        assert warnings == 1
+        assert check_recursive([tempdir], LoggingReporter([]), max_errors=3) == 3
+    assert check_recursive([tempdir], LoggingReporter([]), jobs=jobs) == 20
+
+
+def _read_nothing(filename):
+    return None
+
+
+def _check_expensive(filename, source, reporter, settings_path, **setting_overrides):
+    """Stands in for checking files that are slow, greedy or fine, flagging which process checked each one."""
+    if 'slow' in filename:
+        time.sleep(60)
+    elif 'greedy' in filename:
+        bytearray(2048 * engine.MEGABYTE)
+    reporter.flake(Message(filename, None, os.getpid()))
+    return 1
+
+
+def test_time_and_memory_budgets(monkeypatch):
+    """Files that go over their time or memory budget are reported as such, without holding up the others."""
+    monkeypatch.setattr(engine, 'MAX_CHUNK_FILES', 2)
+    paths = ['first.py', 'slow.py', 'second.py', 'greedy.py', 'third.py']
+    log = []
+    started = time.time()
+    memory_limit = engine.resource and 1024
+    assert engine.run(_read_nothing, _check_expensive, paths, LoggingReporter(log), time_limit=0.5,
+                      memory_limit=memory_limit) == 5
+    assert time.time() - started < 30
+    assert log[1] == ('flake', str(OverBudget('slow.py', None, 'time')))
+    if memory_limit:
+        assert log[3] == ('flake', str(OverBudget('greedy.py', None, 'memory')))
+    assert [entry[1].split(':')[0] for entry in log] == paths
+
+
+def test_check_paths_budgets(monkeypatch):
+    """Files listed one by one are put on a budget in worker processes too."""
+    monkeypatch.setattr(api, '_read_source', _read_nothing)
+    monkeypatch.setattr(api, '_check_source', _check_expensive)
+    paths = ['first.py', 'slow.py', 'second.py']
+    log = []
+    assert check_paths(paths, LoggingReporter(log), time_limit=0.5, recycle_after=1) == 3
+    assert log[1] == ('flake', str(OverBudget('slow.py', None, 'time')))
+    assert os.getpid() != int(log[0][1].split(' ')[-1])
+
+
+def test_workers_are_recycled(monkeypatch):
+    """Worker processes are replaced after checking recycle_after files."""
+    monkeypatch.setattr(engine, 'MAX_CHUNK_FILES', 1)
+    paths = ['module{0}.py'.format(index) for index in range(6)]
+    log = []
+    assert engine.run(_read_nothing, _check_expensive, paths, LoggingReporter(log), jobs=2, recycle_after=1) == 6
+    assert [entry[1].split(':')[0] for entry in log] == paths
+    process_ids = set(int(entry[1].split(' ')[-1]) for entry in log)
+    assert len(process_ids) == 6
+    assert os.getpid() not in process_ids
+
+
+def test_check_staged():
+    """check_staged checks what is in the index, reporting and configuring each file by its working tree path."""
+    repository = tempfile.mkdtemp()
+    try:
+        subprocess.check_call(['git', 'init', '-q', repository])
+    except OSError:
+        pytest.skip('git is not installed')
+    os.mkdir(os.path.join(repository, 'package'))
+    with open(os.path.join(repository, 'package', '.frosted.cfg'), 'w') as config:
+        config.write('[settings]\nignore_frosted_errors=E303\n')
+    sources = {'staged.py': 'import os\n', 'clean.py': 'x = 1\n', os.path.join('package', 'configured.py'): 'x = y\n',
+               'notes.txt': 'import os\n'}
+    for path, source in itemsview(sources):
+        with open(os.path.join(repository, path), 'w') as source_file:
+            source_file.write(source)
+    subprocess.check_call(['git', 'add', '.'], cwd=repository)
+    with open(os.path.join(repository, 'staged.py'), 'w') as source_file:
+        source_file.write('import os\nos.getcwd()\n')
+    with open(os.path.join(repository, 'unstaged.py'), 'w') as source_file:
+        source_file.write('import os\n')
+
+    log = []
+    assert check_staged(LoggingReporter(log), repository=os.path.join(repository, 'package')) == 1
+    staged_path = os.path.relpath(os.path.join(os.path.realpath(repository), 'staged.py'))
+    assert log == [('flake', str(UnusedImport(staged_path, Node(1), 'os')))]
+
+
+def test_result_cache(monkeypatch):
+    """Cached results are replayed without checking again, unless the source or settings have changed."""
+    cache = ResultCache(tempfile.mkdtemp())
+    first_log, second_log = [], []
+    assert check('import os\n', 'cached.py', LoggingReporter(first_log), cache=cache) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError('the cached result should have been used')
+    monkeypatch.setattr(checker, 'Checker', fail)
+    assert check('import os\n', 'cached.py', LoggingReporter(second_log), cache=cache) == 1
+    assert second_log == first_log
+    monkeypatch.undo()
+
+    assert check('import os\n', 'cached.py', LoggingReporter([]), cache=cache, ignore_frosted_errors=['E101']) == 0
+    assert check('import sys\n', 'cached.py', LoggingReporter([]), cache=cache) == 1
+    assert check('import os\n', 'other.py', LoggingReporter([]), cache=cache) == 1
+
+
+def test_signature_covers_interpreter_and_builtins(monkeypatch):
+    """Results are not shared between interpreters, whose grammars differ, or between different sets of builtins."""
+    original = signature('cached.py', {})
+    monkeypatch.setattr('frosted.cache.platform.python_implementation', lambda: 'OtherPython')
+    assert signature('cached.py', {}) != original
+    monkeypatch.undo()
+    monkeypatch.setattr('frosted.cache.sys.version_info', (3, 99, 0, 'final', 0))
+    assert signature('cached.py', {}) != original
+    monkeypatch.undo()
+    monkeypatch.setattr(checker, 'FROSTED_BUILTINS', checker.FROSTED_BUILTINS | set(['extra']))
+    assert signature('cached.py', {}) != original
+    monkeypatch.undo()
+    assert signature('cached.py', {}) == original
+
+
+def test_parse_cache(monkeypatch):
+    """Sources checked recently are neither parsed nor checked again, unless the settings have changed."""
+    parse_cache = ParseCache()
+    first_log, second_log = [], []
+    source = 'import os\nimport sys  # noqa\n'
+    assert check(source, 'parsed.py', LoggingReporter(first_log), parse_cache=parse_cache) == 1
+    monkeypatch.setattr(api, 'compile', lambda *args: pytest.fail('the tree should have been reused'), raising=False)
+    monkeypatch.setattr(api, '_noqa_lines', lambda *args: pytest.fail('the noqa lines should have been reused'))
+    assert check(source, 'parsed.py', LoggingReporter(second_log), parse_cache=parse_cache) == 1
+    assert second_log == first_log
+    assert check(source, 'parsed.py', LoggingReporter([]), parse_cache=parse_cache,
+                 ignore_frosted_errors=['E101']) == 0
+    assert (parse_cache.hits, parse_cache.misses, len(parse_cache)) == (2, 1, 1)
+    monkeypatch.undo()
+
+    assert check('import os\n', 'parsed.py', LoggingReporter([]), parse_cache=parse_cache) == 1
+    assert check('import os\n', 'other.py', LoggingReporter([]), parse_cache=parse_cache) == 1
+    assert (parse_cache.hits, parse_cache.misses, len(parse_cache)) == (2, 3, 3)
+
+
+def test_parse_cache_limits():
+    """The least recently used sources are dropped once there are too many, or they take too much memory."""
+    parse_cache = ParseCache(max_entries=2)
+    for name in ('first.py', 'second.py', 'first.py', 'third.py'):
+        parse_cache.lookup('x = 1\n', name)
+    assert parse_cache.lookup('x = 1\n', 'first.py').results == {}
+    assert (parse_cache.hits, parse_cache.misses) == (2, 3)
+    parse_cache.lookup('x = 1\n', 'second.py')
+    assert parse_cache.misses == 4
+
+    parse_cache = ParseCache(max_bytes=TREE_BYTES_PER_CHARACTER * 10)
+    parse_cache.lookup('x = 1\n', 'small.py')
+    parse_cache.lookup('x = 1\n', 'other.py')
+    assert len(parse_cache) == 1
+    parse_cache.lookup('x = 1\n' * 10, 'large.py')
+    assert len(parse_cache) == 1 and parse_cache.size == TREE_BYTES_PER_CHARACTER * 60
+
+
+def test_result_cache_is_best_effort():
+    """Results are stored as text on every Python version, and results that can not be stored are simply not kept."""
+    cache = ResultCache(tempfile.mkdtemp())
+    recorder = Recorder([UnusedImport('cached.py', Node(1), 'os')])
+    assert isinstance(dumps(recorder, 1), str)
+    cache.put('key', recorder, 1)
+    assert cache.get('key')[0].messages == recorder.messages
+    cache.put('unstorable', Recorder(errors=[('cached.py', object())]), 1)
+    assert cache.get('unstorable') is None
+
+
+def test_result_cache_prune():
+    """Pruning evicts the least recently used results first."""
+    cache = ResultCache(tempfile.mkdtemp(), max_size=0)
+    keys = [cache.key('x = {0}\n'.format(index), 'pruned.py', {}) for index in range(3)]
+    for age, key in enumerate(keys):
+        cache.put(key, Recorder(), 0)
+        os.utime(cache._path(key), (time.time() - 100 * age, time.time() - 100 * age))
+    assert cache.get(keys[2]) is not None
+
+    size = os.path.getsize(cache._path(keys[0]))
+    cache._replace(max_size=size * 2).prune()
+    assert [cache.get(key) is not None for key in keys] == [True, False, True]
+
+
+def test_result_cache_prune_index_files():
+    """Index files left in the cache directory count towards its size, and are evicted along with their journals."""
+    cache = ResultCache(tempfile.mkdtemp(), max_size=0)
+    key = cache.key('import os\n', 'pruned.py', {})
+    cache.put(key, Recorder(), 1)
+    stale = [os.path.join(cache.directory, 'index-gone.sqlite' + suffix) for suffix in ('', '-wal', '-shm')]
+    for path in stale:
+        with open(path, 'w') as index_file:
+            index_file.write('x' * 100)
+        os.utime(path, (time.time() - 100, time.time() - 100))
+    cache._replace(max_size=os.path.getsize(cache._path(key)) + 299).prune()
+    assert not any(os.path.exists(path) for path in stale)
+    assert cache.get(key)[1] == 1
+    assert os.path.exists(os.path.join(cache.directory, 'pruned'))
+
+
+def test_result_cache_sharing():
+    """Damaged entries are ignored, read only caches are never written to and dead writers are cleaned up after."""
+    cache = ResultCache(tempfile.mkdtemp(), max_size=0)
+    key = cache.key('import os\n', 'shared.py', {})
+    cache.put(key, Recorder(), 1)
+    with open(cache._path(key), 'rb') as entry:
+        content = entry.read()
+    with open(cache._path(key), 'wb') as entry:
+        entry.write(content[:-1])
+    assert cache.get(key) is None
+    cache.put(key, Recorder(), 1)
+    assert cache.get(key)[1] == 1
+
+    read_only = cache._replace(read_only=True)
+    other_key = cache.key('import sys\n', 'shared.py', {})
+    read_only.put(other_key, Recorder(), 1)
+    assert read_only.get(other_key) is None
+    read_only.prune()
+    assert read_only.get(key)[1] == 1
+
+    abandoned = cache._path(key) + '.abandoned.tmp'
+    with open(abandoned, 'w') as entry:
+        entry.write('{')
+    cache._replace(max_size=cache.max_size + 1000).prune()
+    assert os.path.exists(abandoned)
+    os.utime(abandoned, (time.time() - STALE_SECONDS - 1, time.time() - STALE_SECONDS - 1))
+    cache._replace(max_size=cache.max_size + 1000).prune()
+    assert not os.path.exists(abandoned)
+    assert cache.get(key)[1] == 1
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_stat_index(monkeypatch, jobs):
+    """Files whose metadata has not changed are not read again, and files that have gone are forgotten."""
+    directory = tempfile.mkdtemp()
+    index = StatIndex(os.path.join(directory, 'cache', 'index.sqlite'))
+    paths = [os.path.join(directory, name) for name in ('a.py', 'b.py', 'c.py')]
+    for path in paths:
+        with open(path, 'w') as source:
+            source.write('import os\n')
+        os.utime(path, (time.time() - 60, time.time() - 60))
+    first_log = []
+    assert check_recursive([directory], LoggingReporter(first_log), jobs=jobs, index=index) == 3
+    assert check_path(paths[0], LoggingReporter([]), index=index) == 1
+
+    with open(paths[1], 'w') as source:
+        source.write('import os, sys\n')
+    os.remove(paths[2])
+    read = api._read_source
+
+    def read_changed(filename):
+        assert filename == paths[1], 'only the modified file should have been read'
+        return read(filename)
+    monkeypatch.setattr(api, '_read_source', read_changed)
+    second_log = []
+    assert check_recursive([directory], LoggingReporter(second_log), jobs=jobs, index=index) == 3
+    assert second_log[0] == first_log[0]
+    assert [entry[1].split(': ', 1)[1] for entry in second_log[1:]] == ['os imported but unused',
+                                                                      'sys imported but unused']
+
+    rows = index.connection.execute('SELECT path FROM files ORDER BY path').fetchall()
+    assert [path for (path, ) in rows] == paths[:2]
+    index.close()
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_check_recursive_dedupe(monkeypatch, jobs):
+    """Identical files are checked once, their warnings being reported against each copy in turn."""
+    monkeypatch.setattr(engine, 'MAX_CHUNK_FILES', 1)
+    directory = tempfile.mkdtemp()
+    sources = {'a': 'module.py', 'b': 'module.py', 'c': 'module.py', 'd': 'other.py'}
+    for (name, filename) in sorted(itemsview(sources)):
+        os.mkdir(os.path.join(directory, name))
+        with open(os.path.join(directory, name, filename), 'w') as source:
+            source.write("import os\ndef function():\n    return undefined\n")
+    with open(os.path.join(directory, 'c', 'module.py'), 'a') as source:
+        source.write("import sys\n")
+
+    plain_log, deduped_log, stats = [], [], {}
+    assert check_recursive([directory], LoggingReporter(plain_log), jobs=jobs, dedupe=False) == 9
+    assert check_recursive([directory], LoggingReporter(deduped_log), jobs=jobs, stats=stats) == 9
+    assert deduped_log == plain_log
+    assert stats['duplicates'] == 1
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_stat_index_remembers_duplicates(monkeypatch, jobs):
+    """Copies spared by deduplication are remembered too, so that none of them is opened again while unchanged."""
+    monkeypatch.setattr(engine, 'MAX_CHUNK_FILES', 1)
+    directory = tempfile.mkdtemp()
+    index = StatIndex(os.path.join(directory, 'cache', 'index.sqlite'))
+    for name in ('a', 'b', 'c'):
+        os.mkdir(os.path.join(directory, name))
+        with open(os.path.join(directory, name, 'mod.py'), 'w') as source:
+            source.write('import os\n')
+        os.utime(source.name, (time.time() - 60, time.time() - 60))
+    first_log, stats = [], {}
+    assert check_recursive([directory], LoggingReporter(first_log), jobs=jobs, index=index, stats=stats) == 3
+    assert stats['duplicates'] == 2
+    assert index.connection.execute('SELECT COUNT(*) FROM files').fetchone()[0] == 3
+
+    monkeypatch.setattr(api, '_read_source', lambda filename: pytest.fail('unchanged files should not be read'))
+    monkeypatch.setattr(api._Duplicates, 'key', lambda self, filename: pytest.fail('nor hashed'))
+    second_log = []
+    assert check_recursive([directory], LoggingReporter(second_log), jobs=jobs, index=index) == 3
+    assert second_log == first_log
+    index.close()
+
+
+def test_stat_index_never_waits():
+    """Results that can not be written because another process is writing are dropped rather than waited for."""
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'module.py')
+    with open(path, 'w') as source:
+        source.write('import os\n')
+    os.utime(path, (time.time() - 60, time.time() - 60))
+    status = StatIndex.stat(path)
+    busy = StatIndex(os.path.join(directory, 'index.sqlite'))
+    index = StatIndex(os.path.join(directory, 'index.sqlite'))
+    busy.connection.execute('BEGIN IMMEDIATE')
+
+    started = time.time()
+    index.record(path, status, 'signature', Recorder(), 0)
+    index.flush()
+    assert time.time() - started < 1
+    assert index.lookup(path, status, 'signature') is None
+
+    busy.close()
+    index.record(path, status, 'signature', Recorder(), 0)
+    index.close()
+    assert StatIndex(os.path.join(directory, 'index.sqlite')).lookup(path, status, 'signature')[1] == 0
+
+
+def test_stat_index_serial_runs(monkeypatch):
+    """Serial runs with an index still read ahead, and stop at the first warning whether or not it was known."""
+    directory = make_modules(10)
+    for name in os.listdir(directory):
+        os.utime(os.path.join(directory, name), (time.time() - 60, time.time() - 60))
+    index = StatIndex(os.path.join(directory, 'cache', 'index.sqlite'))
+    depths = []
+    prefetch = engine.prefetch
+    monkeypatch.setattr(engine, 'prefetch', lambda read, paths, depth: depths.append(depth) or prefetch(read, paths,
+                                                                                                        depth))
+    first_log = []
+    assert check_recursive([directory], LoggingReporter(first_log), read_ahead=2, fail_fast=True, index=index) == 1
+    assert depths == [2] and len(first_log) == 1
+
+    assert check_recursive([directory], LoggingReporter([]), index=index) == 10
+    second_log = []
+    assert check_recursive([directory], LoggingReporter(second_log), fail_fast=True, index=index) == 1
+    assert second_log == first_log
@@ -0,0 +1,64 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import threading
+
+import pytest
+from pies.overrides import *
+
+from frosted import cache, client, daemon, engine
+from frosted.messages import UnusedImport
+
+from .utils import Node
+
+pytestmark = pytest.mark.skipif("not hasattr(__import__('socket'), 'AF_UNIX')")
+
+
+@pytest.fixture
+def socket_path(tmpdir, monkeypatch):
+    # The daemon runs the command line in this process, so keep its caches and history out of the home directory
+    monkeypatch.setattr(cache, 'DEFAULT_CACHE_DIR', str(tmpdir.join('cache', 'results')))
+    monkeypatch.setattr(cache, 'DEFAULT_INDEX_PATH', str(tmpdir.join('cache', 'index.sqlite')))
+    monkeypatch.setattr(engine, 'DEFAULT_HISTORY_PATH', str(tmpdir.join('cache', 'history.json')))
+    path = str(tmpdir.join('frosted.sock'))
+    server = daemon.server(path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield path
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_daemon_checks_files(socket_path, tmpdir):
+    """The daemon runs the given command line relative to the client's working directory."""
+    tmpdir.join('dirty.py').write('import contraband\n')
+    with tmpdir.as_cwd():
+        stdout, stderr, status = client.request(['dirty.py'], path=socket_path)
+    assert stdout.strip() == UnusedImport('dirty.py', Node(1), 'contraband').message
+    assert (stderr, status) == ('', 1)
+    assert os.getcwd() != str(tmpdir)
+
+
+def test_daemon_checks_stdin(socket_path):
+    """Source sent along with the request is checked as if it came from stdin."""
+    assert client.request(['-'], 'import os\nos\n', path=socket_path) == ('', '', 0)
+
+
+def test_daemon_reports_failures(socket_path, tmpdir, monkeypatch):
+    """Requests that fail are answered with the traceback, and a daemon that sends no reply is reported as such."""
+    tmpdir.join('dirty.py').write('import contraband\n')
+    results_path = str(tmpdir.join('missing', 'results.json'))
+    with tmpdir.as_cwd():
+        stdout, stderr, status = client.request(['--results', results_path, 'dirty.py'], path=socket_path)
+        assert 'Traceback' in stderr and status == 1
+        assert client.request(['dirty.py'], path=socket_path)[2] == 1
+
+        monkeypatch.setattr(daemon, 'run', lambda argv, cwd, stdin=None: 1 // 0)
+        assert client.request(['dirty.py'], path=socket_path) == ('', 'frosted: the daemon sent no reply\n', 1)
+
+
+def test_daemon_refuses_second_daemon(socket_path):
+    """Only one daemon can listen on a socket."""
+    with pytest.raises(SystemExit):
+        daemon.server(socket_path)
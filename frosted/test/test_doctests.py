@@ -5,6 +5,7 @@ import textwrap
 import pytest
 from pies.overrides import *
 
+from frosted import checker
 from frosted import messages as m
 
 from .utils import flakes
@@ -236,3 +237,34 @@ def test_noOffsetSyntaxErrorInDoctest():
     assert exc.lineno == 4
     exc = exceptions[1]
     assert exc.lineno == 6
+
+
+def test_offsetsInRepeatedDoctests():
+    """Examples compiled together, or remembered from an identical docstring, are reported on their own lines."""
+    docstring = '''
+                """
+                    >>> first
+                    >>> for x in range(2):
+                    ...     second
+                    <BLANKLINE>
+                    >>> third
+                """
+    '''
+    exceptions = flakes('''
+            def doctest_one():
+            %s
+            def doctest_two():
+            %s
+            ''' % (docstring, docstring), *[m.UndefinedName] * 6, run_doctests=True).messages
+    assert [(exc.lineno, exc.col) for exc in exceptions] == [(5, 12), (7, 16), (9, 12),
+                                                             (15, 12), (17, 16), (19, 12)]
+
+
+def test_docstringsWithoutExamplesAreNotParsed(monkeypatch):
+    monkeypatch.setattr(checker, '_doctest_examples', lambda docstring: pytest.fail('no examples to parse'))
+    flakes('''
+            def doctest_stuff():
+                """
+                    Nothing to see > here.
+                """
+            ''', run_doctests=True)
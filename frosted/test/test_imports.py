@@ -89,6 +89,23 @@ def test_redefinedTryNested():
     os.path''')
 
 
+def test_redefinedDeeplyNestedForks():
+    """Imports are only redefined when no If or Try puts them on different forks, however deeply they are nested."""
+    flakes('''
+    if True:
+        if False:
+            import os
+        else:
+            try:
+                import os
+            except ImportError:
+                import os
+    else:
+        import os
+    import os
+    os.path''', m.RedefinedWhileUnused)
+
+
 def test_redefinedTryExceptMulti():
     flakes("""
     try:
@@ -2,14 +2,43 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import os
+import threading
+import time
 from sys import version_info
 
 import pytest
 from pies.overrides import *
 
+from frosted import checker
 from frosted import messages as m
 
-from .utils import flakes
+from .utils import PyCF_ONLY_AST, flakes
+
+FUNCTIONS = '''
+import os
+import sys
+
+def first():
+    import os
+    unused = 1
+
+def second(value):
+    return os.getcwd(), undefined
+
+def third():
+    import os
+    def nested():
+        import sys
+        return sys
+    return nested
+
+class Thing(object):
+    import re
+    def method(self):
+        import re
+        return missing
+'''  # a module with function bodies of every kind, checked in processes and incrementally below
 
 
 def test_duplicateArgs():
@@ -884,3 +913,66 @@ def test_access_debug():
         print("success!")
         print(__debug__)
     ''')
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_function_jobs(monkeypatch):
+    """Checking function bodies in several processes reports exactly what a serial check does, in the same order."""
+    monkeypatch.setattr(checker, 'MIN_FUNCTIONS_PER_JOB', 1)
+    source = FUNCTIONS
+    tree = compile(source, "<test>", "exec", PyCF_ONLY_AST)
+    serial = checker.Checker(tree).messages
+    assert [(message.type, message.lineno) for message in serial] == [
+        (m.RedefinedWhileUnused, 6), (m.UndefinedName, 10), (m.RedefinedWhileUnused, 22), (m.UndefinedName, 23),
+        (m.RedefinedWhileUnused, 15), (m.UnusedVariable, 7), (m.UnusedImport, 20), (m.UnusedImport, 6),
+        (m.UnusedImport, 13), (m.UnusedImport, 22), (m.UnusedImport, 3)]
+    for jobs in (2, 3):
+        tree = compile(source, "<test>", "exec", PyCF_ONLY_AST)
+        assert checker.Checker(tree, function_jobs=jobs).messages == serial
+
+
+def test_function_jobs_from_threads(monkeypatch):
+    """Function bodies are never checked in forked processes from a thread, where a held lock could hang the fork."""
+    monkeypatch.setattr(checker, 'MIN_FUNCTIONS_PER_JOB', 1)
+    tree = compile(FUNCTIONS, "<test>", "exec", PyCF_ONLY_AST)
+    found = []
+    worker = threading.Thread(target=lambda: found.append(checker.Checker(tree, function_jobs=2).function_jobs()))
+    worker.start()
+    worker.join()
+    assert found == [1]
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_function_jobs_stuck(monkeypatch):
+    """Forked processes that do not report back in time are killed, and the bodies checked serially instead."""
+    serial = checker.Checker(compile(FUNCTIONS, "<test>", "exec", PyCF_ONLY_AST)).messages
+    monkeypatch.setattr(checker, 'MIN_FUNCTIONS_PER_JOB', 1)
+    monkeypatch.setattr(checker, 'FUNCTION_JOB_SECONDS', 0.5)
+    monkeypatch.setattr(checker.Checker, 'run_deferred_share', lambda self, deferred: time.sleep(60))
+    started = time.time()
+    assert checker.Checker(compile(FUNCTIONS, "<test>", "exec", PyCF_ONLY_AST), function_jobs=2).messages == serial
+    assert time.time() - started < 30
+
+
+def test_incremental():
+    """Checking a module again as it is edited reports exactly what checking it from scratch does."""
+    source = FUNCTIONS
+    edits = [source,
+             source.replace('unused = 1', 'unused = 2'),
+             source.replace('undefined', 'sys'),
+             source.replace('import sys\n', 'undefined = 1\n'),
+             source.replace('def second(value)', 'def second(value, other)'),
+             source.replace('return missing', 'return second(1)'),
+             source.replace('return missing', 'return second(1)').replace('def second(value)', 'def second()'),
+             source.replace('    import os\n    unused = 1', '    unused = 1  # noqa'),
+             source + '\nfirst = None\n',
+             source]
+    incremental = checker.Incremental()
+    for edit in edits:
+        fresh = checker.Checker(compile(edit, "<test>", "exec", PyCF_ONLY_AST)).messages
+        tree = compile(edit, "<test>", "exec", PyCF_ONLY_AST)
+        assert checker.Checker(tree, incremental=incremental).messages == fresh
+    assert incremental.reused and incremental.checked
+    checked = incremental.checked
+    checker.Checker(compile(source, "<test>", "exec", PyCF_ONLY_AST), incremental=incremental)
+    assert incremental.checked == checked
@@ -1,28 +1,68 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import textwrap
-import pkg_resources
+
 from mock import MagicMock, patch
 
 from pies.overrides import *
 
-from frosted import checker
+from frosted import checker, plugins
 
 PyCF_ONLY_AST = 1024
 
+
+def _registry(*names):
+    entry_points = []
+    for name in names:
+        entry_point = MagicMock(name=name)
+        entry_point.name = name
+        entry_point.load.return_value = MagicMock(name=name + '.checker', check=MagicMock(
+            return_value=[(MagicMock(), None, (), {})]))
+        entry_points.append(entry_point)
+    find = MagicMock(name='entry_points', return_value=entry_points)
+    return plugins.Registry(find), find, entry_points
+
+
 @patch.object(checker.Checker, 'report')
 def test_plugins(m_report):
     """ Plugins should be invoked by their "check" method
     """
     tree = compile(textwrap.dedent(""), "<test>", "exec", PyCF_ONLY_AST)
-    m_report.return_value = None
-    m_check = MagicMock(name="check", return_value=[(MagicMock(), None, (), {})])
-    m_checker = MagicMock(name="checker", check=m_check)
-    m_load = MagicMock(name="load", return_value=m_checker)
-    m_plugin = MagicMock(name="plugin", load=m_load)
+    registry, find, (entry_point, ) = _registry('plugin')
+
+    with patch.object(plugins, 'registry', registry):
+        checker.Checker(tree, "test.py")
+        checker.Checker(tree, "other.py")
+
+    entry_point.load.return_value.check.assert_called_with("other.py")
+    assert m_report.call_count == 2
+    assert find.call_count == 1
+    assert entry_point.load.call_count == 1
+
+
+@patch.object(checker.Checker, 'report')
+def test_plugins_from_settings(m_report):
+    """ Plugins can be pinned with enabled_plugins or turned off with disabled_plugins, and are only loaded when used
+    """
+    tree = compile(textwrap.dedent(""), "<test>", "exec", PyCF_ONLY_AST)
+    registry, find, (first, second, third) = _registry('first', 'second', 'third')
 
-    with patch.object(pkg_resources, 'iter_entry_points', return_value=[m_plugin]) as mock_ep:
-        checker.Checker(tree, "")
+    with patch.object(plugins, 'registry', registry):
+        checker.Checker(tree, "test.py", enabled_plugins=['first', 'second'], disabled_plugins=['second'])
 
-    assert m_check.assert_called()
-    assert m_report.assert_called()
+    assert first.load.return_value.check.called
+    assert not second.load.called
+    assert not third.load.called
+
+
+def test_plugins_refresh():
+    """ The registry only looks for installed plugins again once refreshed
+    """
+    registry, find, (entry_point, ) = _registry('plugin')
+    assert registry.enabled({}) == ['plugin']
+    registry.load('plugin')
+    assert registry.enabled({}) == ['plugin']
+    registry.refresh()
+    registry.load('plugin')
+    assert find.call_count == 2
+    assert entry_point.load.call_count == 2
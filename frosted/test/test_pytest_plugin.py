@@ -0,0 +1,65 @@
+"""frosted/test/test_pytest_plugin.py.
+
+Tests the pytest plugin checking each collected file with frosted
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated
+documentation files (the "Software"), to deal in the Software without restriction, including without limitation
+the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and
+to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED
+TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import os
+
+import pytest
+from pies.overrides import *
+
+from frosted.pytest_plugin import CACHE_KEY
+
+pytest_plugins = 'pytester'
+
+
+@pytest.fixture
+def run(testdir, request):
+    """Runs pytest within testdir, loading the plugin by hand unless it is installed."""
+    loaded = () if request.config.pluginmanager.has_plugin('frosted') else ('-p', 'frosted.pytest_plugin')
+    return lambda *arguments: testdir.runpytest(*(loaded + arguments))
+
+
+def test_clean_files_are_skipped_until_changed(testdir, run):
+    """Files found clean are skipped on later runs unless their content changes, and problems fail the item."""
+    testdir.makepyfile(clean="import os\nos.getcwd()\n", dirty="import sys\n")
+    result = run('--frosted', '-m', 'frosted')
+    result.assert_outcomes(passed=1, failed=1)
+    result.stdout.fnmatch_lines(['*dirty.py:1:*sys imported but unused*'])
+    clean_files = json.loads(testdir.tmpdir.join('.pytest_cache', 'v', *CACHE_KEY.split('/')).read())
+    assert [os.path.basename(filename) for filename in clean_files] == ['clean.py']
+
+    result = run('--frosted', '-m', 'frosted')
+    result.assert_outcomes(skipped=1, failed=1)
+
+    clean = testdir.tmpdir.join('clean.py')
+    clean.write("import os\nos.getcwd()\n\n")
+    result = run('--frosted', '-m', 'frosted')
+    result.assert_outcomes(passed=1, failed=1)
+
+    os.utime(str(clean), (0, 0))
+    result = run('--frosted', '-m', 'frosted')
+    result.assert_outcomes(skipped=1, failed=1)
+
+
+def test_not_collected_without_option(testdir, run):
+    testdir.makepyfile(dirty="import sys\n")
+    result = run()
+    result.assert_outcomes()
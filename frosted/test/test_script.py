@@ -31,7 +31,7 @@ from pies.overrides import *
 
 import frosted
 from frosted.api import iter_source_code
-from frosted.messages import UnusedImport
+from frosted.messages import UndefinedName, UnusedImport
 
 from .utils import Node
 
@@ -100,10 +100,46 @@ def test_explicitFiles():
     assert list(iter_source_code([epath])) == [epath]
 
 
+def test_overlappingPaths():
+    """Files reached through several of the paths given, or through hard links, are only included once."""
+    os.mkdir(os.path.join(TEMP_DIR, 'pkg'))
+    apath = make_empty_file('pkg', 'a.py')
+    bpath = make_empty_file('b.py')
+    cpath = os.path.join(TEMP_DIR, 'pkg', 'c.py')
+    os.link(bpath, cpath)
+    assert list(iter_source_code([TEMP_DIR, os.path.join(TEMP_DIR, 'pkg'), apath])) == [bpath, apath]
+    assert sorted(iter_source_code([os.path.join(TEMP_DIR, 'pkg'), TEMP_DIR])) == sorted([apath, cpath])
+
+
+@pytest.mark.skipif(not hasattr(os, 'symlink'), reason='symbolic links are not supported')
+def test_symlinks():
+    """Linked files are checked, and linked directories walked if asked to, each target once even through cycles."""
+    os.mkdir(os.path.join(TEMP_DIR, 'pkg'))
+    apath = make_empty_file('pkg', 'a.py')
+    outside = tempfile.mkdtemp()
+    try:
+        for name in ('b.py', 'c.py'):
+            with open(os.path.join(outside, name), 'w'):
+                pass
+        os.symlink(outside, os.path.join(TEMP_DIR, 'linked'))
+        os.symlink(TEMP_DIR, os.path.join(outside, 'cycle'))
+        os.symlink(os.path.join(outside, 'b.py'), os.path.join(TEMP_DIR, 'shared.py'))
+        os.symlink(apath, os.path.join(TEMP_DIR, 'alias.py'))
+        os.symlink(os.path.join(TEMP_DIR, 'missing.py'), os.path.join(TEMP_DIR, 'broken.py'))
+
+        linked_files = [os.path.join(TEMP_DIR, 'alias.py'), os.path.join(TEMP_DIR, 'shared.py')]
+        assert sorted(iter_source_code([TEMP_DIR])) == linked_files
+        assert sorted(iter_source_code([TEMP_DIR], follow_symlinks=True)) == sorted(
+            linked_files + [os.path.join(TEMP_DIR, 'linked', 'c.py')])
+    finally:
+        shutil.rmtree(outside)
+
+
 def run_frosted(paths, stdin=None):
-    """Launch a subprocess running frosted."""
+    """Launch a subprocess running frosted, keeping its result cache and history within TEMP_DIR."""
     env = native_dict(os.environ)
     env['PYTHONPATH'] = os.pathsep.join(sys.path)
+    env['XDG_CACHE_HOME'] = os.path.join(TEMP_DIR, '.cache')
     command = [sys.executable, FROSTED_BINARY]
     command.extend(paths)
     if stdin:
@@ -120,6 +156,18 @@ def run_frosted(paths, stdin=None):
     return (stdout, stderr, rv)
 
 
+def test_duplicatesReported():
+    """Verbose recursive runs say how many identical files were not checked again."""
+    for name in ('a', 'b', 'c'):
+        os.mkdir(os.path.join(TEMP_DIR, name))
+        with open(os.path.join(TEMP_DIR, name, 'module.py'), 'w') as module:
+            module.write('import os\nos\n')
+    stdout, stderr, rv = run_frosted(['-r', '-vb', TEMP_DIR])
+    assert (stderr, rv) == ('frosted: 2 identical files were not checked again\n', 0)
+    stdout, stderr, rv = run_frosted(['-r', TEMP_DIR])
+    assert (stdout, stderr, rv) == ('', '', 0)
+
+
 def test_goodFile():
     """When a Python source file is all good, the return code is zero and no
 
@@ -179,3 +227,76 @@ def test_readFromStdin():
 def test_print_statement_python2():
     d = run_frosted(['-'], stdin='print "Hello, Frosted"'.encode('ascii'))
     assert d == ('', '', 0)
+
+
+def test_shards_and_merge():
+    """Every file is checked by exactly one shard, and frosted merge combines the shard results into one report."""
+    expected = []
+    for index in range(8):
+        module_path = os.path.join(TEMP_DIR, 'module{0}.py'.format(index))
+        with open(module_path, 'w') as module:
+            module.write('import os{0}\n'.format(index))
+        expected.append(UnusedImport(module_path, Node(1), 'os{0}'.format(index)).message)
+
+    shard_lines, results = [], []
+    for index in (1, 2, 3):
+        results.append(os.path.join(TEMP_DIR, 'shard{0}.json'.format(index)))
+        stdout, stderr, rv = run_frosted(['-r', '--shard', '{0}/3'.format(index), '--results', results[-1], TEMP_DIR])
+        shard_lines.extend(stdout.splitlines())
+    assert sorted(shard_lines) == sorted(expected)
+
+    stdout, stderr, rv = run_frosted(['merge'] + results)
+    assert sorted(stdout.splitlines()) == sorted(expected)
+    assert (stderr, rv) == ('', 1)
+
+
+def test_invalid_shard():
+    """Shards are numbered from 1 to N."""
+    stdout, stderr, rv = run_frosted(['--shard', '0/3', TEMP_DIR])
+    assert rv == 2
+    assert 'K must be between 1 and N' in stderr
+
+
+def test_fail_fast():
+    """--fail-fast stops at the first file with a warning, --max-errors after N warnings."""
+    module_paths = []
+    for index in range(3):
+        module_paths.append(os.path.join(TEMP_DIR, 'failfast{0}.py'.format(index)))
+        with open(module_paths[-1], 'w') as module:
+            module.write('import os\nimport sys\n')
+
+    stdout, stderr, rv = run_frosted(['--fail-fast'] + module_paths)
+    assert (len(stdout.splitlines()), rv) == (2, 1)
+    stdout, stderr, rv = run_frosted(['--max-errors', '3'] + module_paths)
+    assert (len(stdout.splitlines()), rv) == (4, 1)
+
+
+def test_stream():
+    """--stream checks each framed buffer under its own name and settings, ending each one's output with a NUL."""
+    configured = os.path.join(TEMP_DIR, 'configured')
+    os.mkdir(configured)
+    with open(os.path.join(configured, '.frosted.cfg'), 'w') as config:
+        config.write('[settings]\nignore_frosted_errors=E101\n')
+
+    stream = b''
+    buffers = ((os.path.join(TEMP_DIR, 'first.py'), 'import os\n'),
+               (os.path.join(configured, 'second.py'), 'import os\nx = y  # \xe9\n'))
+    for filename, source in buffers:
+        source = source.encode('utf-8')
+        stream += '{0} {1}\n'.format(len(source), filename).encode('utf-8') + source
+
+    stdout, stderr, rv = run_frosted(['--stream'], stdin=stream)
+    assert stdout.split('\0\n') == [UnusedImport(buffers[0][0], Node(1), 'os').message + '\n',
+                                    UndefinedName(buffers[1][0], Node(2), 'y').message + '\n', '']
+    assert (stderr, rv) == ('', 1)
+
+
+def test_stream_malformed_header():
+    """A malformed header is reported as a framing error and ends the session cleanly."""
+    source = b'import os\n'
+    for header in (b'garbage\n', b'ten first.py\n', b'-1 first.py\n'):
+        stream = '{0} first.py\n'.format(len(source)).encode('utf-8') + source + header + source
+        stdout, stderr, rv = run_frosted(['--stream'], stdin=stream)
+        assert stdout.split('\0\n') == [UnusedImport('first.py', Node(1), 'os').message + '\n',
+                                        '<stream>: malformed header: {0}\n'.format(header.strip().decode('utf-8')), '']
+        assert (stderr, rv) == ('', 1)
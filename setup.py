@@ -81,6 +81,10 @@ setup(name="frosted",
       entry_points={
         'console_scripts': [
             'frosted = frosted.main:main',
+            'frosted-client = frosted.client:main',
+        ],
+        'pytest11': [
+            'frosted = frosted.pytest_plugin',
         ]
       },
       cmdclass={'test': PyTest},